@@ -0,0 +1,55 @@
+import json
+import os
+import sqlite3
+import time
+
+class AnchorCache:
+    """Persistent key -> JSON value store for anchor detection results, bounded to max_entries.
+
+    When the cache grows past max_entries the least recently used entries are evicted.
+    Safe to share between worker processes: each process opens its own connection.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # Connections must not cross a fork, so reopen in every new process
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS anchors (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS anchors_last_used ON anchors (last_used)")
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        connection = self._connect()
+        row = connection.execute("SELECT value FROM anchors WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with connection:
+            connection.execute("UPDATE anchors SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO anchors (key, value, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time()),
+            )
+            # Evict the least recently used entries beyond the size bound
+            connection.execute(
+                "DELETE FROM anchors WHERE key IN "
+                "(SELECT key FROM anchors ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
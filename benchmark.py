@@ -0,0 +1,294 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from contextlib import redirect_stdout
+from multiprocessing import Pool
+import signpdf
+import print_pdfs
+from listofpdf import generate_file_list
+from text_backends import BACKENDS
+
+# Anchor lines drawn on each generated first page, as (text, height as a fraction of the page
+# from the bottom); files cycle through the cases so every rule and its misses are exercised
+ANCHOR_CASES = {
+    "quiz/review": (("https://moodle.example.org/mod/quiz/review.php?attempt={n}", 0.95),),
+    "тест начат": (("https://moodle.example.org/mod/quiz/review.php?attempt={n}", 0.2),
+                   ("Тест начат  понедельник, 12 мая 2025, 10:00", 0.85)),
+    "тест начат low": (("https://moodle.example.org/mod/quiz/review.php?attempt={n}", 0.2),
+                       ("Тест начат  понедельник, 12 мая 2025, 10:00", 0.45)),
+    "вопрос 1": (("https://moodle.example.org/mod/quiz/review.php?attempt={n}", 0.2),
+                 ("Вопрос 1  Выполнен  Баллов: 1,00 из 1,00", 0.8)),
+    "вопрос 1 low": (("https://moodle.example.org/mod/quiz/review.php?attempt={n}", 0.1),
+                     ("Вопрос 1  Выполнен  Баллов: 1,00 из 1,00", 0.3)),
+    "no fallback line": (("https://moodle.example.org/mod/quiz/review.php?attempt={n}", 0.2),),
+    "no quiz/review": (),
+}
+
+# Filler text for the pages; none of it matches an anchor rule
+WORDS = ("ответ", "задание", "балл", "студент", "верно", "неверно", "решение", "функция", "график",
+         "answer", "value", "matrix", "integral", "limit", "series", "proof", "lemma", "case")
+SURNAMES = ("Иванов", "Петрова", "Сидоров", "Кузнецова", "Смирнов", "Попова", "Ёлкин", "Щукина",
+            "Smith", "O'Brien")
+FIRST_NAMES = ("Иван", "Мария", "Алексей", "Юлия", "Пётр", "Анна", "John")
+
+# Words per line of filler text and the corpus sizes the default run covers
+WORDS_PER_LINE = 8
+PAGE_COUNTS = (2, 20)
+WORD_DENSITIES = (100, 800)
+
+# Benchmark results slower than the baseline by more than this factor are reported as regressions
+REGRESSION_THRESHOLD = 1.25
+
+def make_pdf(path, pages, words, anchor_lines, rng):
+    """Write one synthetic quiz export: filler text on every page, anchor lines on the first."""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+
+    signpdf.register_font()
+    width, height = A4
+    c = canvas.Canvas(path, pagesize=A4, invariant=1)
+    line_count = -(-words // WORDS_PER_LINE)
+    top, bottom = height - 50, 40
+    step = min(14, (top - bottom) / max(line_count, 1))
+    for page in range(pages):
+        c.setFont('DejaVu', min(10, step))
+        anchors = [(text, fraction * height) for text, fraction in anchor_lines] if page == 0 else []
+        for i in range(line_count):
+            y = top - i * step
+            # Keep filler clear of the anchor lines so they are extracted as lines of their own
+            if any(abs(y - anchor_y) < 12 for _, anchor_y in anchors):
+                continue
+            c.drawString(60, y, ' '.join(rng.choice(WORDS) for _ in range(WORDS_PER_LINE)))
+        c.setFont('DejaVu', 10)
+        for text, y in anchors:
+            c.drawString(60, y, text)
+        c.showPage()
+    c.save()
+
+def generate_corpus(directory, count, pages, words, seed=0):
+    """Write count synthetic PDFs with Cyrillic and Latin filenames to directory.
+
+    The same arguments always produce the same files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    cases = list(ANCHOR_CASES)
+    filenames = []
+    for n in range(1, count + 1):
+        anchor_lines = [(text.format(n=n), fraction) for text, fraction in ANCHOR_CASES[cases[(n - 1) % len(cases)]]]
+        filename = f"{rng.choice(SURNAMES)} {rng.choice(FIRST_NAMES)}_{n}.pdf"
+        make_pdf(os.path.join(directory, filename), pages, words, anchor_lines, rng)
+        filenames.append(filename)
+    return filenames
+
+def measure(run, repeat, setup=None):
+    """Wall-clock seconds of each of repeat calls to run, with its log output discarded."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+    return times
+
+def clear_caches():
+    """Forget rendered overlays so every run pays for them like a fresh batch does."""
+    signpdf.render_overlay.cache_clear()
+    signpdf.place_overlay.cache_clear()
+
+def _sign_batch(jobs, workers):
+    if workers == 1:
+        for job in jobs:
+            signpdf.sign_one(*job)
+        return
+    with Pool(processes=workers or None) as pool:
+        for log in pool.imap(signpdf._sign_one_captured, jobs, chunksize=4):
+            pass
+
+def benchmark_corpus(corpus_dir, filenames, work_dir, backends, worker_counts, repeat, list_entries):
+    """Time every stage on one corpus and return the result records (without corpus details)."""
+    paths = [os.path.join(corpus_dir, f) for f in filenames]
+    results = []
+
+    def record(stage, times, backend=None, workers=None, items=len(paths)):
+        results.append({
+            "stage": stage,
+            "backend": backend,
+            "workers": workers,
+            "items": items,
+            "best_seconds": min(times),
+            "median_seconds": statistics.median(times),
+            "per_item_ms": min(times) / max(items, 1) * 1000,
+            "runs": times,
+        })
+
+    for backend in backends:
+        # Text extraction of the whole first page, then the rules alone on the extracted layouts
+        layouts = []
+        record("extract", measure(lambda: layouts.extend(signpdf.load_first_page_layout(p, backend) for p in paths),
+                                  repeat, layouts.clear), backend)
+        record("rules", measure(lambda: [signpdf.match_anchor(lambda: iter((layout,)), layout.page_height)
+                                         for layout in layouts], repeat), backend)
+        # Banded detection as signing runs it: extraction stops as soon as a rule is settled
+        record("detect", measure(lambda: [signpdf.detect_anchor(p, backend) for p in paths], repeat), backend)
+
+    # Stamping alone, for the files that have a position
+    x_pos, y_pos = signpdf.DEFAULT_TEXT_X_POSITION, signpdf.DEFAULT_TEXT_Y_POSITION
+    stamped = []
+    for path, filename in zip(paths, filenames):
+        y_position = signpdf.detect_anchor(path, backends[0])[0]
+        if y_position is not None:
+            stamped.append((path, signpdf.extract_text_from_filename(filename), y_position))
+    record("stamp", measure(lambda: [signpdf.process_pdf(path, io.BytesIO(), text, x_pos, y)
+                                     for path, text, y in stamped], repeat, clear_caches), items=len(stamped))
+
+    # Whole batches, as signpdf.main and print_pdfs.main run them
+    signed_dir = os.path.join(work_dir, "signed")
+    imposed_dir = os.path.join(work_dir, "imposed")
+    default_backend = signpdf.TEXT_BACKEND
+    try:
+        for backend in backends:
+            signpdf.TEXT_BACKEND = backend
+            for workers in worker_counts:
+                def reset():
+                    clear_caches()
+                    shutil.rmtree(signed_dir, ignore_errors=True)
+                    os.makedirs(signed_dir)
+                jobs = [(f, corpus_dir, signed_dir, x_pos, y_pos) for f in filenames]
+                record("sign_batch", measure(lambda: _sign_batch(jobs, workers), repeat, reset), backend, workers)
+    finally:
+        signpdf.TEXT_BACKEND = default_backend
+
+    groups = print_pdfs.split_into_groups(sorted(os.listdir(signed_dir)))
+    for workers in worker_counts:
+        def reset():
+            shutil.rmtree(imposed_dir, ignore_errors=True)
+            os.makedirs(imposed_dir)
+        record("impose", measure(lambda: print_pdfs.run_groups(groups, signed_dir, imposed_dir, workers),
+                                 repeat, reset), workers=workers)
+
+    # The file list for a batch of list_entries names built from the corpus names
+    names = [f"{os.path.splitext(filenames[i % len(filenames)])[0]}-{i}" for i in range(list_entries)]
+    list_path = os.path.join(work_dir, "file_list.pdf")
+    record("file_list", measure(lambda: generate_file_list(names, list_path), repeat), items=list_entries)
+    return results
+
+def run_benchmarks(count=21, page_counts=PAGE_COUNTS, word_densities=WORD_DENSITIES, backends=tuple(BACKENDS),
+                   worker_counts=(1,), repeat=3, list_entries=5000, seed=0, corpus_root=None):
+    """Generate a corpus for every (pages, words) combination and time all stages on each.
+
+    Returns the results document: run metadata and one record per stage, backend and worker count.
+    """
+    import reportlab
+    import fitz  # PyMuPDF
+    import pdfplumber
+    import PyPDF2
+
+    keep_corpus = corpus_root is not None
+    corpus_root = corpus_root or tempfile.mkdtemp(prefix="signpdf-bench-")
+    results = []
+    try:
+        for pages in page_counts:
+            for words in word_densities:
+                corpus_dir = os.path.join(corpus_root, f"pages-{pages}-words-{words}")
+                work_dir = os.path.join(corpus_root, f"work-{pages}-{words}")
+                shutil.rmtree(corpus_dir, ignore_errors=True)
+                os.makedirs(work_dir, exist_ok=True)
+                filenames = generate_corpus(corpus_dir, count, pages, words, seed)
+                print(f"Corpus of {count} PDFs with {pages} pages and {words} words per page")
+                for result in benchmark_corpus(corpus_dir, filenames, work_dir, list(backends), list(worker_counts),
+                                               repeat, list_entries):
+                    result.update(pages=pages, words=words)
+                    results.append(result)
+                    print(f"  {result_key(result)}: {result['best_seconds']:.3f} s "
+                          f"({result['per_item_ms']:.2f} ms per item)")
+                shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        if not keep_corpus:
+            shutil.rmtree(corpus_root, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "versions": {"reportlab": reportlab.Version, "PyMuPDF": fitz.VersionBind,
+                         "pdfplumber": pdfplumber.__version__, "PyPDF2": PyPDF2.__version__},
+            "files": count,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+def result_key(result):
+    """Identifies the same measurement across result files."""
+    parts = [result["stage"], f"pages={result['pages']}", f"words={result['words']}"]
+    if result["backend"]:
+        parts.append(f"backend={result['backend']}")
+    if result["workers"]:
+        parts.append(f"workers={result['workers']}")
+    return " ".join(parts)
+
+def compare(results, baseline):
+    """Print how each result compares with the baseline document; return the regressions."""
+    previous = {result_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        key = result_key(result)
+        if key not in previous:
+            continue
+        ratio = result["best_seconds"] / max(previous[key]["best_seconds"], 1e-9)
+        flag = ""
+        if ratio > REGRESSION_THRESHOLD:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"{key}: {previous[key]['best_seconds']:.3f} s -> {result['best_seconds']:.3f} s ({ratio:.2f}x){flag}")
+    return regressions
+
+def _int_list(value):
+    return tuple(int(v) for v in value.split(","))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every stage on synthetic quiz-PDF corpora.")
+    parser.add_argument("--files", type=int, default=21, help="PDFs per corpus")
+    parser.add_argument("--pages", type=_int_list, default=PAGE_COUNTS, help="comma-separated page counts")
+    parser.add_argument("--words", type=_int_list, default=WORD_DENSITIES,
+                        help="comma-separated numbers of words per page")
+    parser.add_argument("--backends", type=lambda v: tuple(v.split(",")), default=tuple(BACKENDS),
+                        help="comma-separated text extraction backends")
+    parser.add_argument("--workers", type=_int_list, default=(1,),
+                        help="comma-separated worker counts for the batch stages")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement; the best one is reported")
+    parser.add_argument("--list-entries", type=int, default=5000, help="names in the file list benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the generated corpora")
+    parser.add_argument("--corpus-dir", help="keep the generated corpora in this directory")
+    parser.add_argument("--output", default="benchmark-results.json", help="where to write the results as JSON")
+    parser.add_argument("--baseline", help="results JSON to compare with; exits with 1 on regressions")
+    args = parser.parse_args(argv)
+    unknown = set(args.backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(sorted(unknown))}")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_benchmarks(args.files, args.pages, args.words, args.backends, args.workers, args.repeat,
+                             args.list_entries, args.seed, args.corpus_dir)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, ensure_ascii=False, indent=1)
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            sys.exit(1 if compare(results, json.load(file)) else 0)
@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+from signpdf import detect_anchor
+from text_backends import BACKENDS
+
+# Largest difference in points between backends that still counts as the same Y position
+TOLERANCE = 0.5
+
+# Corpus generated when no directory is given: every anchor case of benchmark.py three times,
+# on dense pages so text near the anchors is extracted too; the seed keeps it reproducible
+GENERATED_FILES = 21
+GENERATED_PAGES = 2
+GENERATED_WORDS = 800
+GENERATED_SEED = 0
+
+# Page geometries the generated corpus also covers, as (name, MediaBox, CropBox, /Rotate);
+# each is applied to one file of every anchor case (None keeps the generated box)
+PAGE_VARIANTS = (
+    ("cropped", None, (20, 40, 575, 800), 0),
+    ("rotated 90", None, None, 90),
+    ("rotated 180", None, None, 180),
+    ("rotated 270", None, None, 270),
+    ("cropped rotated 90", None, (20, 40, 575, 800), 90),
+    ("offset", (-30, 10, 565, 852), (0, 30, 500, 820), 0),
+)
+
+def check_parity(corpus_dir):
+    """Run anchor detection with every backend on each PDF in corpus_dir and report mismatches."""
+    mismatches = 0
+    filenames = sorted(f for f in os.listdir(corpus_dir) if f.lower().endswith('.pdf'))
+    for filename in filenames:
+        input_path = os.path.join(corpus_dir, filename)
+        results = {backend: detect_anchor(input_path, backend) for backend in BACKENDS}
+        reference_y, reference_rule, _ = results["pdfplumber"]
+        for backend, (y_position, rule, _) in results.items():
+            same_y = (y_position is None) == (reference_y is None) and (
+                y_position is None or abs(y_position - reference_y) <= TOLERANCE)
+            if rule != reference_rule or not same_y:
+                mismatches += 1
+                print(f"MISMATCH {filename}: pdfplumber={reference_y} ({reference_rule}), {backend}={y_position} ({rule})")
+    print(f"Checked {len(filenames)} PDFs with {len(BACKENDS)} backends, {mismatches} mismatches")
+    return mismatches == 0
+
+def write_page_variants(corpus_dir, filenames):
+    """Copy each of filenames in corpus_dir once per PAGE_VARIANTS, applied to every page."""
+    from PyPDF2 import PdfReader, PdfWriter
+    from PyPDF2.generic import NameObject, NumberObject, RectangleObject
+
+    for filename in filenames:
+        for name, mediabox, cropbox, rotate in PAGE_VARIANTS:
+            writer = PdfWriter()
+            for page in PdfReader(os.path.join(corpus_dir, filename)).pages:
+                if mediabox:
+                    page.mediabox = RectangleObject(mediabox)
+                if cropbox:
+                    page.cropbox = RectangleObject(cropbox)
+                if rotate:
+                    page[NameObject("/Rotate")] = NumberObject(rotate)
+                writer.add_page(page)
+            writer.write(os.path.join(corpus_dir, f"{os.path.splitext(filename)[0]} {name}.pdf"))
+
+def check_generated_corpus():
+    """check_parity on a freshly generated synthetic corpus, so it can run unattended."""
+    from benchmark import ANCHOR_CASES, generate_corpus
+
+    with tempfile.TemporaryDirectory(prefix="signpdf-parity-") as corpus_dir:
+        filenames = generate_corpus(corpus_dir, GENERATED_FILES, GENERATED_PAGES, GENERATED_WORDS, GENERATED_SEED)
+        # generate_corpus cycles through the anchor cases, so this is one file of each
+        write_page_variants(corpus_dir, filenames[:len(ANCHOR_CASES)])
+        return check_parity(corpus_dir)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        ok = check_parity(sys.argv[1])
+    else:
+        ok = check_generated_corpus()
+    sys.exit(0 if ok else 1)
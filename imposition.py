@@ -0,0 +1,175 @@
+import os
+
+# A4 landscape sheet in points
+A4_LANDSCAPE = (841.89, 595.28)
+
+class LazyDocument:
+    """A source PDF that is only open while its pages are being placed.
+
+    impose opens it for the first sheet that uses it and closes it after the last one, so
+    however many sources a group has, only those on the current sheet are open.
+    """
+
+    def __init__(self, path):
+        import fitz  # PyMuPDF
+
+        self.path = path
+        self.size = os.path.getsize(path)
+        with fitz.open(path) as doc:
+            self.page_count = len(doc)
+        self._doc = None
+
+    def __len__(self):
+        return self.page_count
+
+    @property
+    def page_bytes(self):
+        """Average share of the file per page, an estimate of what placing one page adds."""
+        return self.size / max(self.page_count, 1)
+
+    def open(self):
+        import fitz  # PyMuPDF
+
+        if self._doc is None:
+            self._doc = fitz.open(self.path)
+        return self._doc
+
+    def close(self):
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+
+class Imposition:
+    """N-up layout: a grid of cells on each output sheet, one source page per cell.
+
+    Each page is scaled to fit fill_width x fill_height of its cell and centred in it.
+    Placement rectangles are computed once per (cell, source page size).
+    """
+
+    def __init__(self, sheet_size=A4_LANDSCAPE, columns=2, rows=1, fill_width=0.9, fill_height=0.95):
+        self.sheet_width, self.sheet_height = sheet_size
+        self.columns = columns
+        self.rows = rows
+        self.fill_width = fill_width
+        self.fill_height = fill_height
+        self._placements = {}
+
+    @property
+    def cells_per_sheet(self):
+        return self.columns * self.rows
+
+    def placement(self, cell, source_width, source_height):
+        """Rectangle (x0, y0, x1, y1) a source page of the given size occupies in cell."""
+        key = (cell, source_width, source_height)
+        if key not in self._placements:
+            cell_width = self.sheet_width / self.columns
+            cell_height = self.sheet_height / self.rows
+            column, row = cell % self.columns, cell // self.columns
+            scale = min(cell_width * self.fill_width / source_width,
+                        cell_height * self.fill_height / source_height)
+            actual_width = source_width * scale
+            actual_height = source_height * scale
+            x0 = (column + 0.5) * cell_width - actual_width / 2
+            y0 = (row + 0.5) * cell_height - actual_height / 2
+            self._placements[key] = (x0, y0, x0 + actual_width, y0 + actual_height)
+        return self._placements[key]
+
+    def sheets(self, slots):
+        """Split a flat list of slots into sheets of cells_per_sheet slots."""
+        per_sheet = self.cells_per_sheet
+        return [slots[i:i + per_sheet] for i in range(0, len(slots), per_sheet)]
+
+    def impose(self, sheets, output_path, flush_every=None, flush_bytes=None):
+        """Write sheets to output_path. A sheet is a list of (doc, page number) or None for blank.
+
+        With flush_every, the output is saved to disk every flush_every sheets and reopened,
+        so memory stays bounded however many sheets there are. With flush_bytes it is also
+        saved once the LazyDocument pages placed since the last save add up to about that
+        many bytes. LazyDocument sources are closed after the last sheet that uses them.
+        """
+        import fitz  # PyMuPDF
+
+        last_use = {}
+        for index, sheet in enumerate(sheets, 1):
+            for slot in sheet:
+                if slot is not None and isinstance(slot[0], LazyDocument):
+                    last_use[slot[0]] = index
+
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        doc_out = fitz.open()
+        on_disk = False
+        placed_bytes = 0
+        for index, sheet in enumerate(sheets, 1):
+            page_out = doc_out.new_page(width=self.sheet_width, height=self.sheet_height)
+            for cell, slot in enumerate(sheet):
+                if slot is None:
+                    continue
+                doc, page_num = slot
+                if isinstance(doc, LazyDocument):
+                    placed_bytes += doc.page_bytes
+                    doc = doc.open()
+                rect = doc[page_num].rect
+                page_out.show_pdf_page(fitz.Rect(self.placement(cell, rect.width, rect.height)), doc, page_num)
+
+            # Release the sources this sheet placed the last page of
+            for slot in sheet:
+                if slot is not None and last_use.get(slot[0]) == index:
+                    slot[0].close()
+
+            if (flush_every and index % flush_every == 0) or (flush_bytes is not None and placed_bytes >= flush_bytes):
+                placed_bytes = 0
+                # Append what we have to the file and start again from a lazily loaded copy
+                if on_disk:
+                    doc_out.saveIncr()
+                else:
+                    doc_out.save(output_path)
+                    on_disk = True
+                doc_out.close()
+                doc_out = fitz.open(output_path)
+
+        if on_disk:
+            if doc_out.is_dirty:
+                doc_out.saveIncr()
+        else:
+            doc_out.save(output_path)
+        doc_out.close()
+
+def deduplicate_resources(path):
+    """Rewrite an imposed PDF with identical fonts, images and XObjects merged.
+
+    Every source document brings its own copies of the same resources; garbage collection
+    level 4 merges objects and streams with identical content, drops unused objects and
+    compresses the rest. Returns the file size before and after.
+    """
+    import fitz  # PyMuPDF
+
+    size_before = os.path.getsize(path)
+    temp_path = path + ".tmp"
+    with fitz.open(path) as doc:
+        doc.save(temp_path, garbage=4, deflate=True, deflate_images=True, deflate_fonts=True)
+    os.replace(temp_path, path)
+    return size_before, os.path.getsize(path)
+
+def reverse_sheets(sheets):
+    """Back sides for manual duplex: the stack is turned over, so sheets come in reverse order."""
+    return sheets[::-1]
+
+def booklet_sheets(doc, page_count=None):
+    """Saddle-stitch order for one document on a 2-up layout.
+
+    Returns sheets alternating front and back: the first front holds the last and first
+    pages, its back the second and second-to-last, and so on. Pages are padded with blanks
+    to a multiple of four.
+    """
+    page_count = len(doc) if page_count is None else page_count
+    padded = -(-page_count // 4) * 4
+
+    def slot(page_num):
+        return (doc, page_num) if page_num < page_count else None
+
+    sheets = []
+    for i in range(padded // 4):
+        sheets.append([slot(padded - 1 - 2 * i), slot(2 * i)])
+        sheets.append([slot(2 * i + 1), slot(padded - 2 - 2 * i)])
+    return sheets
@@ -0,0 +1,248 @@
+import io
+import struct
+from PyPDF2 import PdfReader
+from PyPDF2.errors import DependencyError, PyPdfError
+from metrics import stage
+from pdf_source import open_source
+from PyPDF2.generic import (
+    ArrayObject,
+    ContentStream,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    read_object,
+)
+
+# Prefix for the overlay's font resource names so they never clash with the page's own fonts
+RESOURCE_PREFIX = "Sgn"
+
+def rename_overlay_fonts(content, page_fonts):
+    """Rename the fonts that content (an overlay ContentStream) selects, in place.
+
+    New names are RESOURCE_PREFIX plus the overlay's own name, numbered when page_fonts
+    already has one (a file stamped twice), so they never clash and never depend on the run.
+    Returns {overlay name: new name} for the fonts content uses.
+    """
+    names = {}
+    for operands, operator in content.operations:
+        if operator == b"Tf":
+            name = operands[0]
+            if name not in names:
+                new_name = NameObject(f"/{RESOURCE_PREFIX}{name[1:]}")
+                number = 1
+                while new_name in page_fonts or new_name in names.values():
+                    number += 1
+                    new_name = NameObject(f"/{RESOURCE_PREFIX}{number}{name[1:]}")
+                names[name] = new_name
+            operands[0] = names[name]
+    return names
+
+def _find_startxref(source):
+    """Return (offset, size, ends_with_newline): the byte offset stored after the last
+    'startxref' keyword, the file size and whether the file ends with a line break."""
+    size = len(source)
+    # The trailer lives in the last few hundred bytes; read a generous tail
+    tail = bytes(source.data[max(0, size - 4096):])
+    index = tail.rfind(b"startxref")
+    if index == -1:
+        raise ValueError(f"{source.path}: startxref not found")
+    return int(tail[index + len(b"startxref"):].split()[0]), size, tail.endswith((b"\n", b"\r"))
+
+class _ObjectAllocator:
+    """Hands out object numbers for the update section and keeps the objects to write."""
+
+    def __init__(self, first_number):
+        self.next_number = first_number
+        self.objects = {}  # object number -> (generation, object)
+        self.mapping = {}  # overlay object number -> new object number
+
+    def add(self, obj, number=None, generation=0):
+        if number is None:
+            number = self.next_number
+            self.next_number += 1
+        self.objects[number] = (generation, obj)
+        return IndirectObject(number, generation, None)
+
+    def copy(self, obj):
+        """Deep-copy an object from the overlay PDF, renumbering indirect references."""
+        if isinstance(obj, IndirectObject):
+            if obj.idnum not in self.mapping:
+                reference = self.add(None)
+                self.mapping[obj.idnum] = reference.idnum
+                self.objects[reference.idnum] = (0, self.copy(obj.get_object()))
+            return IndirectObject(self.mapping[obj.idnum], 0, None)
+        if isinstance(obj, DictionaryObject):
+            if isinstance(obj, (EncodedStreamObject, DecodedStreamObject)):
+                clone = obj.__class__()
+                clone._data = obj._data
+            else:
+                clone = DictionaryObject()
+            for key, value in obj.items():
+                clone[NameObject(key)] = self.copy(value)
+            return clone
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.copy(value) for value in obj)
+        return obj
+
+def _read_xref_dictionary(reader, offset):
+    """Return the dictionary of the cross-reference section at offset and whether it is an
+    xref stream (PDF 1.5+) rather than a classic xref table.
+
+    For a classic table that is the trailer. PyPDF2 does not copy /Size from xref streams into
+    reader.trailer, so the stream's own dictionary is read instead.
+    """
+    stream = reader.stream
+    stream.seek(offset)
+    if stream.read(32).lstrip().startswith(b"xref"):
+        dictionary, is_stream = reader.trailer, False
+    else:
+        stream.seek(offset)
+        try:
+            reader.read_object_header(stream)
+            dictionary = read_object(stream, reader)
+        except Exception as e:
+            raise ValueError(f"unreadable cross-reference section at {offset}: {e}")
+        if not isinstance(dictionary, DictionaryObject) or dictionary.get("/Type") != "/XRef":
+            raise ValueError(f"no cross-reference table or stream at {offset}")
+        is_stream = True
+    if "/Size" not in dictionary:
+        raise ValueError("cross-reference section without /Size")
+    return dictionary, is_stream
+
+def _subsections(numbers):
+    """Split sorted object numbers into runs of consecutive numbers."""
+    start = 0
+    while start < len(numbers):
+        end = start
+        while end + 1 < len(numbers) and numbers[end + 1] == numbers[end] + 1:
+            end += 1
+        yield numbers[start:end + 1]
+        start = end + 1
+
+def _stream(data):
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    return stream
+
+def append_overlay(input_file, output_file, overlay_page):
+    """Write input_file (a path or PdfSource) to output_file (a path or binary stream) with
+    overlay_page stamped on page 0 as an incremental update.
+
+    The original bytes are copied unchanged; the update appends the overlay's content stream
+    and fonts, a replacement page-0 object and an xref section pointing back at the original
+    one with /Prev. Only the first page of input_file is parsed.
+    """
+    with open_source(input_file) as source:
+        prev_xref, original_size, ends_with_newline = _find_startxref(source)
+        try:
+            reader = PdfReader(source.stream())
+        except (PyPdfError, DependencyError) as e:
+            raise ValueError(f"{source.path}: {e}")
+        if reader.is_encrypted:
+            raise ValueError(f"{source.path}: encrypted documents cannot be updated incrementally")
+        trailer, xref_is_stream = _read_xref_dictionary(reader, prev_xref)
+        size = int(trailer["/Size"])
+        page = reader.pages[0]
+        page_reference = page.indirect_reference
+
+        allocator = _ObjectAllocator(size)
+
+        # Page resources may be shared with other pages, so extend a copy of them
+        resources = DictionaryObject(page.get("/Resources", DictionaryObject()).get_object())
+        fonts = DictionaryObject(resources.get("/Font", DictionaryObject()).get_object())
+
+        # Rename the overlay's fonts and keep only the ones its content actually uses
+        overlay_content = ContentStream(overlay_page.get_contents(), overlay_page.pdf)
+        overlay_fonts = overlay_page["/Resources"].get_object()["/Font"].get_object()
+        for name, new_name in rename_overlay_fonts(overlay_content, fonts).items():
+            fonts[new_name] = allocator.copy(overlay_fonts.raw_get(name))
+        resources[NameObject("/Font")] = fonts
+
+        # Wrap the original content in q/Q so its graphics state cannot leak into the overlay
+        original_contents = page.get("/Contents")
+        if original_contents is None:
+            original_contents = ArrayObject()
+        elif isinstance(original_contents.get_object(), ArrayObject):
+            original_contents = ArrayObject(original_contents.get_object())
+        else:
+            original_contents = ArrayObject([original_contents])
+        contents = ArrayObject([allocator.add(_stream(b"q\n"))])
+        contents.extend(original_contents)
+        contents.append(allocator.add(_stream(b"\nQ\n" + overlay_content.get_data())))
+
+        new_page = DictionaryObject()
+        for key in page.keys():
+            new_page[NameObject(key)] = page.raw_get(key)
+        new_page[NameObject("/Contents")] = contents
+        new_page[NameObject("/Resources")] = resources
+        allocator.add(new_page, page_reference.idnum, page_reference.generation)
+
+        # An xref stream section needs an object number of its own
+        xref_number = None
+        if xref_is_stream:
+            xref_number = allocator.next_number
+            allocator.next_number += 1
+
+        new_trailer = DictionaryObject()
+        for key in ("/Root", "/Info", "/ID"):
+            if key in trailer:
+                new_trailer[NameObject(key)] = trailer.raw_get(key)
+        new_trailer[NameObject("/Size")] = NumberObject(max(allocator.next_number, size))
+        new_trailer[NameObject("/Prev")] = NumberObject(prev_xref)
+
+        # Serialize the update section
+        update = io.BytesIO()
+        if not ends_with_newline:
+            update.write(b"\n")
+        offsets = {}
+        for number in sorted(allocator.objects):
+            generation, obj = allocator.objects[number]
+            offsets[number] = original_size + update.tell()
+            update.write(f"{number} {generation} obj\n".encode())
+            obj.write_to_stream(update, None)
+            update.write(b"\nendobj\n")
+
+        xref_offset = original_size + update.tell()
+        if xref_is_stream:
+            # Continue the chain of xref streams with one more, written uncompressed
+            offsets[xref_number] = xref_offset
+            offset_width = max(4, (xref_offset.bit_length() + 7) // 8)
+            index = ArrayObject()
+            rows = io.BytesIO()
+            for run in _subsections(sorted(offsets)):
+                index.extend([NumberObject(run[0]), NumberObject(len(run))])
+                for number in run:
+                    generation = allocator.objects[number][0] if number != xref_number else 0
+                    rows.write(b"\x01" + offsets[number].to_bytes(offset_width, "big") + struct.pack(">H", generation))
+            xref_stream = _stream(rows.getvalue())
+            xref_stream.update(new_trailer)
+            xref_stream[NameObject("/Type")] = NameObject("/XRef")
+            xref_stream[NameObject("/W")] = ArrayObject([NumberObject(1), NumberObject(offset_width), NumberObject(2)])
+            xref_stream[NameObject("/Index")] = index
+            update.write(f"{xref_number} 0 obj\n".encode())
+            xref_stream.write_to_stream(update, None)
+            update.write(b"\nendobj\n")
+        else:
+            update.write(b"xref\n")
+            # Emit one subsection per run of consecutive object numbers
+            for run in _subsections(sorted(offsets)):
+                update.write(f"{run[0]} {len(run)}\n".encode())
+                for number in run:
+                    generation = allocator.objects[number][0]
+                    update.write(f"{offsets[number]:010d} {generation:05d} n\r\n".encode())
+            update.write(b"trailer\n")
+            new_trailer.write_to_stream(update, None)
+        update.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+        # The original bytes go out untouched, followed by the update section
+        with stage("write"):
+            if hasattr(output_file, "write"):
+                output_file.write(source.data)
+                output_file.write(update.getvalue())
+            else:
+                with open(output_file, "wb") as output_stream:
+                    output_stream.write(source.data)
+                    output_stream.write(update.getvalue())
@@ -1,25 +1,35 @@
 import os
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.pagesizes import A4
 
-def scan_and_generate_pdf():
-    input_dir = os.path.join(os.getcwd(), 'in')
-    output_dir = os.path.join(os.getcwd(), 'out')
-    os.makedirs(output_dir, exist_ok=True)
+def largest_fitting_size(text, unit_width, max_width, min_size, max_size):
+    """Largest whole font size in [min_size, max_size] at which text is at most max_width wide.
+
+    Returns min_size when even that is too wide. unit_width is the width of text at size 1;
+    the estimate from it is checked against the exact width so rounding cannot move the result.
+    """
+    from reportlab.pdfbase import pdfmetrics
+
+    if unit_width <= 0:
+        return max_size
+    size = max(min_size, min(max_size, int(max_width // unit_width)))
+    while size < max_size and pdfmetrics.stringWidth(text, 'DejaVu', size + 1) <= max_width:
+        size += 1
+    while size > min_size and pdfmetrics.stringWidth(text, 'DejaVu', size) > max_width:
+        size -= 1
+    return size
+
+def generate_file_list(filenames, output_pdf_path):
+    """Lay out filenames in as few columns and as large a font as fit, and save the PDF."""
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.lib.pagesizes import A4
 
     font_path = os.path.join(os.path.dirname(__file__), 'fonts', 'DejaVuSans.ttf')
     if not os.path.exists(font_path):
         raise FileNotFoundError(f"Font file not found: {font_path}")
-    pdfmetrics.registerFont(TTFont('DejaVu', font_path))
+    if 'DejaVu' not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont('DejaVu', font_path))
 
-    filenames = [os.path.splitext(f)[0] for f in os.listdir(input_dir) if f.endswith('.pdf')]
-    if not filenames:
-        print("No PDF files found in the input directory.")
-        return
-
-    output_pdf_path = os.path.join(output_dir, 'file_list.pdf')
     c = canvas.Canvas(output_pdf_path, pagesize=A4)
 
     # Define margins for the PDF layout
@@ -29,22 +39,22 @@ def scan_and_generate_pdf():
     max_font_size, min_font_size = 20, 8  # Set font size limits
     max_columns = 4  # Maximum number of columns to display
 
+    # Width is linear in font size, so one measurement per name at unit size is enough:
+    # the widest name alone decides which font sizes fit a column
+    widest, widest_unit_width = '', 0.0
+    for filename in filenames:
+        unit_width = pdfmetrics.stringWidth(filename, 'DejaVu', 1)
+        if unit_width > widest_unit_width:
+            widest, widest_unit_width = filename, unit_width
+
     column_count = 1  
     optimal_font_size = max_font_size  
 
     # Determine the optimal font size and number of columns
     while column_count <= max_columns:
         column_width = available_width / column_count  # Calculate width for each column
-        font_size = max_font_size  # Start with the maximum font size
-
-        # Check each filename to see if it fits within the column width
-        for filename in filenames:
-            text_width = pdfmetrics.stringWidth(filename, 'DejaVu', font_size)
-            # Decrease font size until the text fits or reaches the minimum size
-            while text_width > (column_width - 20) and font_size > min_font_size:
-                font_size -= 1
-                text_width = pdfmetrics.stringWidth(filename, 'DejaVu', font_size)
-        
+        font_size = largest_fitting_size(widest, widest_unit_width, column_width - 20, min_font_size, max_font_size)
+
         # Calculate how many lines can fit in the available height
         line_height = font_size + 4  # Add some padding
         max_lines = (available_height // line_height)  # Maximum lines per column
@@ -83,6 +93,20 @@ def scan_and_generate_pdf():
         line_count += 1
 
     c.save()
+
+def scan_and_generate_pdf():
+    input_dir = os.path.join(os.getcwd(), 'in')
+    output_dir = os.path.join(os.getcwd(), 'out')
+    os.makedirs(output_dir, exist_ok=True)
+
+    filenames = [os.path.splitext(f)[0] for f in os.listdir(input_dir) if f.endswith('.pdf')]
+    if not filenames:
+        print("No PDF files found in the input directory.")
+        return
+
+    output_pdf_path = os.path.join(output_dir, 'file_list.pdf')
+    generate_file_list(filenames, output_pdf_path)
     print(f"PDF file created: {output_pdf_path}")
 
-scan_and_generate_pdf()
+if __name__ == "__main__":
+    scan_and_generate_pdf()
@@ -0,0 +1,43 @@
+import hashlib
+import json
+import os
+
+# Manifest file kept next to the outputs; bump the version when the key layout changes
+MANIFEST_NAME = ".signpdf-manifest.json"
+MANIFEST_VERSION = 1
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def build_key(**parts):
+    """Combine everything an output depends on into a single stable key."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def load_manifest(output_dir):
+    """Return the {output name: {'input': ..., 'key': ...}} entries of the last run."""
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"Error reading {manifest_path}: {e}. Rebuilding all outputs.")
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest.get("entries", {})
+
+def save_manifest(output_dir, entries):
+    """Atomically replace the manifest with the given entries."""
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump({"version": MANIFEST_VERSION, "entries": entries}, file, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
@@ -0,0 +1,178 @@
+import json
+import time
+import statistics
+import tracemalloc
+from contextlib import contextmanager
+
+# Stages a signed file goes through, in the order they are reported
+STAGES = ("open", "extract", "rules", "render", "merge", "write")
+
+# Slowest files listed in the end-of-run summary
+SLOWEST_FILES = 5
+
+class FileMetrics:
+    """Timings and facts about one file as it is signed.
+
+    Stage times are exclusive: time spent in a stage nested inside another (extraction
+    while the rules run, say) is only counted for the inner one.
+    """
+
+    def __init__(self, file):
+        self.record = {"file": file, "stages": {}}
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            stages = self.record["stages"]
+            stages[name] = stages.get(name, 0.0) + elapsed - nested
+
+_current = None
+
+def _reset_peak_rss():
+    """Reset this process's RSS high-water mark; False where the OS does not allow it."""
+    try:
+        # Linux only: writing 5 to clear_refs resets VmHWM in /proc/self/status
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_kb():
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return None
+
+@contextmanager
+def measure_file(file):
+    """Collect the stages and notes of everything done for file inside the block."""
+    global _current
+    metrics = FileMetrics(file)
+    previous, _current = _current, metrics
+    # Peak memory of this file alone: the RSS high-water mark reset for it where possible,
+    # otherwise the traced Python allocations if tracemalloc is already running
+    rss = _reset_peak_rss()
+    traced = not rss and tracemalloc.is_tracing()
+    if traced:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield metrics.record
+    finally:
+        _current = previous
+        metrics.record["seconds"] = time.perf_counter() - start
+        if rss:
+            metrics.record["peak_rss_kb"] = _peak_rss_kb()
+        elif traced:
+            metrics.record["peak_traced_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+
+@contextmanager
+def stage(name):
+    """Time the block as stage name of the file being measured, if any."""
+    if _current is None:
+        yield
+    else:
+        with _current.stage(name):
+            yield
+
+def note(**fields):
+    """Attach fields such as the matched rule to the file being measured, if any."""
+    if _current is not None:
+        _current.record.update(fields)
+
+def _peaks(records, key):
+    """Median and largest per-file peak, and the file with the largest."""
+    measured = [r for r in records if r.get(key) is not None]
+    largest = max(measured, key=lambda r: r[key])
+    return {"median": statistics.median(r[key] for r in measured), "max": largest[key], "file": largest["file"]}
+
+class MetricsWriter:
+    """Writes one JSON line per file and a summary line when closed."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8")
+        self._records = []
+
+    def write(self, record):
+        self._records.append(record)
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def summary(self):
+        records = self._records
+        seconds = sorted(r["seconds"] for r in records)
+        rules = {}
+        for r in records:
+            rules[r.get("rule")] = rules.get(r.get("rule"), 0) + 1
+        return {
+            "files": len(records),
+            "seconds": sum(seconds),
+            "median_seconds": statistics.median(seconds) if seconds else 0.0,
+            "p95_seconds": seconds[int(0.95 * (len(seconds) - 1))] if seconds else 0.0,
+            "max_seconds": seconds[-1] if seconds else 0.0,
+            "stages": {name: sum(r["stages"].get(name, 0.0) for r in records) for name in STAGES},
+            "rules": rules,
+            "bytes_in": sum(r.get("bytes_in", 0) for r in records),
+            "bytes_out": sum(r.get("bytes_out", 0) for r in records),
+            "memory": {key: _peaks(records, key) for key in ("peak_rss_kb", "peak_traced_kb")
+                       if any(r.get(key) is not None for r in records)},
+            "slowest": [(r["file"], r["seconds"]) for r in sorted(records, key=lambda r: -r["seconds"])[:SLOWEST_FILES]],
+        }
+
+    def close(self):
+        summary = self.summary()
+        self._file.write(json.dumps({"summary": summary}, ensure_ascii=False) + "\n")
+        self._file.close()
+
+        print(f"Metrics for {summary['files']} files written to {self.path}")
+        print(f"Total {summary['seconds']:.2f}s, median {summary['median_seconds'] * 1000:.1f} ms, "
+              f"p95 {summary['p95_seconds'] * 1000:.1f} ms, max {summary['max_seconds'] * 1000:.1f} ms")
+        print("Stages: " + ", ".join(f"{name} {total:.2f}s" for name, total in summary["stages"].items()))
+        print("Rules: " + ", ".join(f"{rule} {count}" for rule, count in summary["rules"].items()))
+        for key, peaks in summary["memory"].items():
+            print(f"Per-file {key}: median {peaks['median']}, max {peaks['max']} ({peaks['file']})")
+        for file, seconds in summary["slowest"]:
+            print(f"  slow: {file} {seconds * 1000:.1f} ms")
+
+def profile_call(func, *args, profile_path=None, top=25):
+    """Run func(*args) under cProfile and tracemalloc and print where time and memory went.
+
+    With profile_path the raw profile is saved for tools such as snakeviz or pstats.
+    """
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    try:
+        profiler.enable()
+        try:
+            result = func(*args)
+        finally:
+            profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+    print(f"Peak traced memory: {peak / 1024:.0f} KiB; largest allocations still held:")
+    for statistic in snapshot.statistics("lineno")[:10]:
+        print(f"  {statistic}")
+    if profile_path:
+        profiler.dump_stats(profile_path)
+        print(f"Profile written to {profile_path}")
+    return result
@@ -0,0 +1,91 @@
+import argparse
+import hashlib
+import io
+import mmap
+import os
+from contextlib import contextmanager
+from metrics import stage
+
+class PdfSource:
+    """One input PDF, read from disk once and handed to every library that parses it.
+
+    By default the file is read into a single bytes object; io.BytesIO and PyMuPDF share
+    that buffer without copying it. With use_mmap the file is memory-mapped instead and
+    each stream() is a separate read-only mapping of the same pages.
+    """
+
+    def __init__(self, path, use_mmap=False):
+        self.path = path
+        self._file = None
+        self._map = None
+        if use_mmap and os.path.getsize(path) > 0:
+            self._file = open(path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = memoryview(self._map)
+        else:
+            with open(path, "rb") as file:
+                self.data = file.read()
+        self._sha256 = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def stream(self):
+        """A new binary file object over the contents, positioned at the start."""
+        if self._map is not None:
+            return mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return io.BytesIO(self.data)
+
+    def sha256(self):
+        """SHA-256 hex digest of the contents, computed once."""
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).hexdigest()
+        return self._sha256
+
+    def open_fitz(self):
+        """Open the contents with PyMuPDF without copying them."""
+        import fitz  # PyMuPDF
+
+        return fitz.open(stream=self.data, filetype="pdf")
+
+    def write_to(self, output_file):
+        """Write the unchanged contents to a path or binary stream."""
+        if hasattr(output_file, "write"):
+            output_file.write(self.data)
+        else:
+            with open(output_file, "wb") as file:
+                file.write(self.data)
+
+    def close(self):
+        if self._map is not None:
+            self.data.release()
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def parse_memory_budget(value):
+    """argparse type for --memory-budget: megabytes, 0 or more (0 treats every input as too large)."""
+    try:
+        megabytes = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"memory budget must be a whole number of MB, got {value!r}")
+    if megabytes < 0:
+        raise argparse.ArgumentTypeError(f"memory budget cannot be negative, got {megabytes}")
+    return megabytes
+
+@contextmanager
+def open_source(input_file, use_mmap=False):
+    """Yield a PdfSource for a path, or the given PdfSource itself (left open for its owner)."""
+    if isinstance(input_file, PdfSource):
+        yield input_file
+    else:
+        with stage("open"):
+            source = PdfSource(input_file, use_mmap)
+        with source:
+            yield source
@@ -0,0 +1,125 @@
+import os
+import io
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+from multiprocessing import Pool
+import signpdf
+import print_pdfs
+from imposition import LazyDocument
+from listofpdf import generate_file_list
+from pdf_source import parse_memory_budget
+from sharding import parse_shard, select_shard, shard_dir, write_shard_manifest
+
+def sign_and_impose_group(group_files, group_number, input_dir, output_dir, x_pos, y_pos, keep_signed=False):
+    """Sign each file of a group into memory and impose the signed buffers straight away.
+
+    With a memory budget the signed files go to disk instead (temporary ones unless
+    keep_signed) and are only opened while their pages are placed.
+    """
+    import fitz  # PyMuPDF
+
+    print(f"Processing group {group_number} with {len(group_files)} PDFs")
+    if signpdf.MEMORY_BUDGET_MB is not None:
+        sign_and_impose_group_on_disk(group_files, group_number, input_dir, output_dir, x_pos, y_pos, keep_signed)
+        return
+
+    docs = []  # Keep document references
+    try:
+        for filename in group_files:
+            buffer = io.BytesIO()
+            signpdf.sign_file(os.path.join(input_dir, filename), buffer, None, x_pos, y_pos)
+            if keep_signed:
+                with open(os.path.join(output_dir, signpdf.output_name_for(filename)), "wb") as file:
+                    file.write(buffer.getbuffer())
+            docs.append(fitz.open(stream=buffer.getvalue(), filetype="pdf"))
+        print_pdfs.impose_group(docs, group_number, output_dir)
+    finally:
+        # Clean up: close all documents
+        for doc in docs:
+            doc.close()
+
+def sign_and_impose_group_on_disk(group_files, group_number, input_dir, output_dir, x_pos, y_pos, keep_signed):
+    with tempfile.TemporaryDirectory(dir=output_dir) as temp_dir:
+        docs = []
+        try:
+            for filename in group_files:
+                signed_path = os.path.join(output_dir if keep_signed else temp_dir, signpdf.output_name_for(filename))
+                signpdf.sign_file(os.path.join(input_dir, filename), signed_path, None, x_pos, y_pos)
+                docs.append(LazyDocument(signed_path))
+            print_pdfs.impose_group(docs, group_number, output_dir)
+        finally:
+            for doc in docs:
+                doc.close()
+
+def _init_worker(memory_budget_mb):
+    signpdf.set_memory_budget(memory_budget_mb)
+    print_pdfs.set_memory_budget(memory_budget_mb)
+
+def _group_job(args):
+    """Pool entry point: run one group and hand back its log output."""
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        sign_and_impose_group(*args)
+    return buffer.getvalue()
+
+def run_pipeline(input_dir="in", output_dir="out", workers=1, keep_signed=False, shard=None):
+    """Sign every PDF in input_dir and impose the results for printing without intermediate files.
+
+    Writes the group outputs and file_list.pdf to output_dir; with keep_signed the signed
+    PDFs are saved there too. Input files are left where they are. With shard=(i, N) only
+    the i-th of N slices is processed, into its own directory under output_dir, and the
+    file list is left to sharding.merge_shards.
+    """
+    os.makedirs(input_dir, exist_ok=True)
+    if shard is not None:
+        output_dir = shard_dir(output_dir, shard)
+    signpdf.clear_output_dir(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    pdf_files = [f for f in os.listdir(input_dir) if f.endswith(".pdf")]
+    if shard is not None:
+        pdf_files = select_shard(pdf_files, shard)
+    if not pdf_files:
+        print("No PDF files found in the input directory.")
+        return
+
+    groups = print_pdfs.split_into_groups(pdf_files)
+    if shard is not None:
+        write_shard_manifest(output_dir, shard, pdf_files, [(number, files) for files, number in groups])
+    else:
+        # The file list is built from the same scan as the signing
+        output_pdf_path = os.path.join(output_dir, 'file_list.pdf')
+        generate_file_list([os.path.splitext(f)[0] for f in pdf_files], output_pdf_path)
+        print(f"PDF file created: {output_pdf_path}")
+
+    text_x_position, text_y_position = signpdf.load_coordinates()
+    jobs = [(group_files, group_number, input_dir, output_dir, text_x_position, text_y_position, keep_signed)
+            for group_files, group_number in groups]
+
+    if workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            sign_and_impose_group(*job)
+        return
+
+    # Groups are independent; imap hands the log output back in group order
+    with Pool(processes=workers or None, initializer=_init_worker, initargs=(signpdf.MEMORY_BUDGET_MB,)) as pool:
+        for log in pool.imap(_group_job, jobs):
+            print(log, end='')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sign every PDF in in/ and impose the signed copies for printing into out/.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes (1 = serial, 0 = one per CPU core)")
+    parser.add_argument("--keep-signed", action="store_true",
+                        help="also save the signed PDFs to out/")
+    parser.add_argument("--shard", type=parse_shard, metavar="I/N",
+                        help="process only the I-th of N deterministic slices of in/ into out/shard-I-of-N/")
+    parser.add_argument("--memory-budget", type=parse_memory_budget, metavar="MB",
+                        help="keep each process within about MB megabytes for very large inputs")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    _init_worker(args.memory_budget)
+    run_pipeline(workers=args.workers, keep_signed=args.keep_signed, shard=args.shard)
@@ -1,169 +1,183 @@
 import os
 from pathlib import Path
 import math
-import fitz  # PyMuPDF
 import shutil  # Added for file operations
+import argparse
+import io
+from contextlib import redirect_stdout
+from multiprocessing import Pool
+from imposition import A4_LANDSCAPE, Imposition, LazyDocument, booklet_sheets, deduplicate_resources, reverse_sheets
+from pdf_source import parse_memory_budget
+from sharding import load_shard_manifest, parse_shard, shard_dir, write_shard_manifest
+
+# Number of worker processes imposing groups (1 = serial, 0 = one per CPU core)
+WORKERS = 1
+
+# Sheet layout: A4 landscape with two pages side by side
+LAYOUT = Imposition(A4_LANDSCAPE, columns=2, rows=1, fill_width=0.9, fill_height=0.95)
+
+# "sections" imposes the page ranges in SECTIONS; "booklet" folds each document into saddle-stitched sheets
+ORDERING = "sections"
+
+# Output documents per group: (name, first page, end page or None for all, reverse sheet order).
+# Every document fills end - first cells of a section, padded with blank cells when it is shorter.
+SECTIONS = (
+    ("first_pages", 0, 2, False),
+    ("last_pages", 2, 4, True),
+)
+
+# Merge the resources every source document repeats (fonts, images, XObjects) in each output
+DEDUPLICATE_RESOURCES = True
+
+# Save imposed output every this many sheets so memory stays bounded on long print runs
+FLUSH_EVERY = 200
+
+# Memory budget per process in MB for very large sources (None = unlimited). With a budget,
+# sources are opened only while their pages are placed, the output is saved whenever the
+# pages placed since the last save may exceed half the budget, and outputs too large to
+# deduplicate within the budget are left as they are
+MEMORY_BUDGET_MB = None
+
+# Peak memory of deduplicate_resources relative to the size of the file it rewrites
+DEDUPLICATE_MEMORY_FACTOR = 3
+
+def set_memory_budget(megabytes):
+    """Set MEMORY_BUDGET_MB; also the Pool initializer that passes it on to worker processes."""
+    global MEMORY_BUDGET_MB
+    MEMORY_BUDGET_MB = megabytes
 
 def arrange_pages_two_up(input_pages, output_path):
     """Arrange pages two per page in album layout"""
-    # Create a new PDF with landscape orientation
-    doc_out = fitz.open()
-    
-    # Calculate dimensions for A4 landscape
-    width = 841.89  # A4 height in points (landscape)
-    height = 595.28  # A4 width in points (landscape)
-    
-    # Process pages two at a time
-    for i in range(0, len(input_pages), 2):
-        # Create a new landscape page
-        page_out = doc_out.new_page(width=width, height=height)
-        
-        # Calculate scaled dimensions for each input page
-        # Use slightly less than half width to create margin
-        scale_width = (width * 0.48)
-        scale_height = height * 0.95
-        
-        # Add first page of the pair
-        page = input_pages[i]
-        rect = page.rect
-        scale_factor = min(scale_width/rect.width, scale_height/rect.height)
-        scaled_width = rect.width * scale_factor
-        scaled_height = rect.height * scale_factor
-        
-        # Calculate position for first page (left side)
-        x1 = (width/4) - (scaled_width/2)
-        y1 = (height/2) - (scaled_height/2)
-        page_out.show_pdf_page(
-            fitz.Rect(x1, y1, x1 + scaled_width, y1 + scaled_height),
-            doc_out,
-            page.number
-        )
-        
-        # Add second page if available
-        if i + 1 < len(input_pages):
-            page = input_pages[i + 1]
-            rect = page.rect
-            scale_factor = min(scale_width/rect.width, scale_height/rect.height)
-            scaled_width = rect.width * scale_factor
-            scaled_height = rect.height * scale_factor
-            
-            # Calculate position for second page (right side)
-            x2 = (3*width/4) - (scaled_width/2)
-            y2 = (height/2) - (scaled_height/2)
-            page_out.show_pdf_page(
-                fitz.Rect(x2, y2, x2 + scaled_width, y2 + scaled_height),
-                doc_out,
-                page.number
-            )
-    
-    # Save the output document
-    doc_out.save(output_path)
-    doc_out.close()
-
-def process_pdf_group(pdf_files, group_number):
-    """Process a group of PDFs and create first_pages and last_pages documents"""
-    first_pages = []
-    last_pages = []
-    docs = []  # Keep document references
-    
-    # Create a blank PDF document for blank pages
-    blank_doc = fitz.open()
-    blank_page = blank_doc.new_page(width=595.28, height=841.89)  # A4 portrait
-    docs.append(blank_doc)  # Add to docs for proper cleanup
-    
-    # Collect pages from all PDFs in the group
-    for pdf_file in pdf_files:
-        doc = fitz.open(os.path.join('in', pdf_file))
-        docs.append(doc)  # Store document reference
-        
-        # Get first two pages, add blank if missing
-        for i in range(2):  # Always process 2 pages
-            if i < len(doc):
-                first_pages.append((doc, i, False))  # False = not blank
-            else:
-                first_pages.append((blank_doc, 0, True))  # True = blank
-        
-        # Get third and fourth pages, add blank if missing
-        for i in range(2, 4):  # Always process pages 3 and 4
-            if i < len(doc):
-                last_pages.append((doc, i, False))
-            else:
-                last_pages.append((blank_doc, 0, True))
-    
-    # Reverse the order of document pairs in last_pages, but keep page order within each document
-    last_pages_reversed = []
-    for i in range(len(last_pages)-1, -1, -2):
-        if i > 0:  # If we have two pages
-            last_pages_reversed.extend([last_pages[i-1], last_pages[i]])
-        else:  # If we have one page left
-            last_pages_reversed.append(last_pages[i])
-    last_pages = last_pages_reversed
+    layout = Imposition(A4_LANDSCAPE, columns=2, rows=1, fill_width=0.96, fill_height=0.95)
+    slots = [(page.parent, page.number) for page in input_pages]
+    layout.impose(layout.sheets(slots), output_path, FLUSH_EVERY)
 
+def section_slots(docs, first, end):
+    """Slots for pages first..end of every document, padding short documents with blanks."""
+    if end is None:
+        # Take all remaining pages, giving every document the same number of cells
+        end = max((len(doc) for doc in docs), default=first)
+    slots = []
+    for doc in docs:
+        for i in range(first, end):
+            slots.append((doc, i) if i < len(doc) else None)
+    return slots
+
+def write_sheets(sheets, output_path):
+    """Impose sheets into output_path and optionally shrink it by merging duplicate resources."""
+    budget = MEMORY_BUDGET_MB * 1024 * 1024 if MEMORY_BUDGET_MB is not None else None
+    LAYOUT.impose(sheets, output_path, FLUSH_EVERY, budget // 2 if budget is not None else None)
+    if DEDUPLICATE_RESOURCES:
+        if budget is not None and os.path.getsize(output_path) * DEDUPLICATE_MEMORY_FACTOR > budget:
+            print(f"Not deduplicating {output_path}: too large for the memory budget")
+            return
+        size_before, size_after = deduplicate_resources(output_path)
+        print(f"Deduplicated {output_path}: {size_before} -> {size_after} bytes")
+
+def impose_group(docs, group_number, output_dir='out'):
+    """Create one imposed document per section (or a booklet) from a group of open documents"""
     # Create output directory if it doesn't exist
-    Path('out').mkdir(exist_ok=True)
-    
+    Path(output_dir).mkdir(exist_ok=True)
+
+    if ORDERING == "booklet":
+        if LAYOUT.cells_per_sheet != 2:
+            raise ValueError("Booklet ordering needs a 2-up layout")
+        sheets = [sheet for doc in docs for sheet in booklet_sheets(doc)]
+        if sheets:
+            write_sheets(sheets, os.path.join(output_dir, f'booklet_group_{group_number}.pdf'))
+        return
+
+    # Create output PDFs
+    for name, first, end, reverse in SECTIONS:
+        slots = section_slots(docs, first, end)
+        if not slots:
+            continue
+        sheets = LAYOUT.sheets(slots)
+        if reverse:
+            sheets = reverse_sheets(sheets)
+        write_sheets(sheets, os.path.join(output_dir, f'{name}_group_{group_number}.pdf'))
+
+def process_pdf_group(pdf_files, group_number, input_dir='in', output_dir='out'):
+    """Process a group of PDFs from input_dir and create their imposed documents in output_dir"""
+    import fitz  # PyMuPDF
+
+    docs = []  # Keep document references
     try:
-        # Function to process a set of pages
-        def create_output_pdf(pages, output_path):
-            doc_out = fitz.open()
-            width = 841.89  # A4 height in points (landscape)
-            height = 595.28  # A4 width in points (landscape)
-            page_width = width * 0.45
-            page_height = height * 0.95
-            
-            for i in range(0, len(pages), 2):
-                page_out = doc_out.new_page(width=width, height=height)
-                
-                # Process first page
-                doc, page_num, is_blank = pages[i]
-                if not is_blank:
-                    source_page = doc[page_num]
-                    scale_w = page_width / source_page.rect.width
-                    scale_h = page_height / source_page.rect.height
-                    scale = min(scale_w, scale_h)
-                    actual_width = source_page.rect.width * scale
-                    actual_height = source_page.rect.height * scale
-                    x1 = (width/4) - (actual_width/2)
-                    y1 = (height/2) - (actual_height/2)
-                    page_out.show_pdf_page(
-                        fitz.Rect(x1, y1, x1 + actual_width, y1 + actual_height),
-                        doc,
-                        page_num
-                    )
-                
-                # Process second page if available
-                if i + 1 < len(pages):
-                    doc, page_num, is_blank = pages[i + 1]
-                    if not is_blank:
-                        source_page = doc[page_num]
-                        scale_w = page_width / source_page.rect.width
-                        scale_h = page_height / source_page.rect.height
-                        scale = min(scale_w, scale_h)
-                        actual_width = source_page.rect.width * scale
-                        actual_height = source_page.rect.height * scale
-                        x2 = (3*width/4) - (actual_width/2)
-                        y2 = (height/2) - (actual_height/2)
-                        page_out.show_pdf_page(
-                            fitz.Rect(x2, y2, x2 + actual_width, y2 + actual_height),
-                            doc,
-                            page_num
-                        )
-            
-            doc_out.save(output_path)
-            doc_out.close()
-        
-        # Create output PDFs
-        if first_pages:
-            create_output_pdf(first_pages, f'out/first_pages_group_{group_number}.pdf')
-        if last_pages:
-            create_output_pdf(last_pages, f'out/last_pages_group_{group_number}.pdf')
-            
+        # Collect pages from all PDFs in the group
+        for pdf_file in pdf_files:
+            if MEMORY_BUDGET_MB is not None:
+                # Opened and released by LAYOUT.impose around the sheets that use them
+                docs.append(LazyDocument(os.path.join(input_dir, pdf_file)))
+            else:
+                docs.append(fitz.open(os.path.join(input_dir, pdf_file)))
+        impose_group(docs, group_number, output_dir)
     finally:
         # Clean up: close all documents
         for doc in docs:
             doc.close()
 
-def main():
+# Number of PDFs imposed together into one set of group outputs
+GROUP_SIZE = 5
+
+def split_into_groups(pdf_files, group_size=GROUP_SIZE):
+    """Return (files, group number) pairs, numbering groups from 1 in file order"""
+    num_groups = math.ceil(len(pdf_files) / group_size)
+    groups = []
+    for group_num in range(num_groups):
+        start_idx = group_num * group_size
+        end_idx = min((group_num + 1) * group_size, len(pdf_files))
+        groups.append((pdf_files[start_idx:end_idx], group_num + 1))
+    return groups
+
+def _process_group_job(args):
+    """Pool entry point: impose one group and hand back its log output."""
+    group_files, group_number, input_dir, output_dir = args
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        print(f"Processing group {group_number} with {len(group_files)} PDFs")
+        process_pdf_group(group_files, group_number, input_dir, output_dir)
+    return buffer.getvalue()
+
+def run_groups(groups, input_dir, output_dir, workers):
+    """Impose (files, group number) pairs from input_dir into output_dir"""
+    if workers == 1 or len(groups) <= 1:
+        for current_group, group_number in groups:
+            print(f"Processing group {group_number} with {len(current_group)} PDFs")
+            process_pdf_group(current_group, group_number, input_dir, output_dir)
+        return
+
+    # Groups share nothing, so they can be imposed in parallel; imap reports them in order
+    jobs = [(group_files, group_number, input_dir, output_dir) for group_files, group_number in groups]
+    with Pool(processes=workers or None, initializer=set_memory_budget, initargs=(MEMORY_BUDGET_MB,)) as pool:
+        for log in pool.imap(_process_group_job, jobs):
+            print(log, end='')
+
+def impose_shard(shard, workers):
+    """Impose the PDFs one shard signed, in place in its directory under out/.
+
+    Unlike the unsharded run nothing is moved to in/, which other shards may share; the
+    groups are numbered locally and recorded for sharding.merge_shards to renumber.
+    """
+    from signpdf import output_name_for
+
+    directory = shard_dir('out', shard)
+    manifest = load_shard_manifest(directory)
+    inputs = {output_name_for(f): f for f in manifest["files"]}
+    pdf_files = [f for f in inputs if os.path.exists(os.path.join(directory, f))]
+    groups = split_into_groups(pdf_files)
+    run_groups(groups, directory, directory, workers)
+    # The manifest names inputs, like the shard manifests pipeline.py writes
+    write_shard_manifest(directory, shard, manifest["files"],
+                         [(number, [inputs[f] for f in files]) for files, number in groups])
+
+def main(workers=None, shard=None):
+    if workers is None:
+        workers = WORKERS
+
+    if shard is not None:
+        impose_shard(shard, workers)
+        return
+
     # Create directories if they don't exist
     Path('in').mkdir(exist_ok=True)
     Path('out').mkdir(exist_ok=True)
@@ -186,17 +200,20 @@ def main():
     # Get all PDF files from the input directory
     pdf_files = [f for f in os.listdir('in') if f.lower().endswith('.pdf')]
     
-    # Process PDFs in groups of 5
-    group_size = 5
-    num_groups = math.ceil(len(pdf_files) / group_size)
-    
-    for group_num in range(num_groups):
-        start_idx = group_num * group_size
-        end_idx = min((group_num + 1) * group_size, len(pdf_files))
-        current_group = pdf_files[start_idx:end_idx]
-        
-        print(f"Processing group {group_num + 1} with {len(current_group)} PDFs")
-        process_pdf_group(current_group, group_num + 1)
+    # Process PDFs in groups of GROUP_SIZE
+    run_groups(split_into_groups(pdf_files), 'in', 'out', workers)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Impose the signed PDFs from out/ two-up for printing.")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="number of worker processes (1 = serial, 0 = one per CPU core)")
+    parser.add_argument("--shard", type=parse_shard, metavar="I/N",
+                        help="impose the PDFs signed by signpdf.py --shard I/N in out/shard-I-of-N/")
+    parser.add_argument("--memory-budget", type=parse_memory_budget, metavar="MB", default=MEMORY_BUDGET_MB,
+                        help="keep each process within about MB megabytes for very large sources")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    args = parse_args()
+    set_memory_budget(args.memory_budget)
+    main(workers=args.workers, shard=args.shard)
@@ -0,0 +1,172 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+from manifest import MANIFEST_NAME, save_manifest
+
+# Per-shard record of what a node produced, read back by merge_shards
+SHARD_MANIFEST_NAME = "shard.json"
+
+def parse_shard(spec):
+    """Parse 'i/N' (1 <= i <= N) into (i, N)."""
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", spec)
+    if not match:
+        raise argparse.ArgumentTypeError(f"shard must look like i/N, got {spec!r}")
+    index, count = int(match.group(1)), int(match.group(2))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard index must be between 1 and {count}, got {index}")
+    return index, count
+
+def shard_of(filename, count):
+    """Shard (1..count) a file belongs to; stable across machines, runs and Python versions."""
+    digest = hashlib.sha256(filename.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+def select_shard(filenames, shard):
+    """The shard's slice of filenames, sorted so every node sees the same order."""
+    index, count = shard
+    return sorted(f for f in filenames if shard_of(f, count) == index)
+
+def shard_dir(output_dir, shard):
+    """Separate output location for one shard inside output_dir."""
+    index, count = shard
+    return os.path.join(output_dir, f"shard-{index}-of-{count}")
+
+def load_shard_manifest(directory):
+    """The shard manifest in directory, or an empty one if the shard has not written it yet."""
+    path = os.path.join(directory, SHARD_MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"files": [], "groups": []}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+def write_shard_manifest(directory, shard, files=None, groups=None):
+    """Record the shard's input files and its locally numbered groups.
+
+    groups is a list of (group number, files) in group order. files, in both, are input
+    filenames (X.pdf), not the signed outputs (X-sgn.pdf).
+    """
+    index, count = shard
+    manifest = {
+        "shard": index,
+        "count": count,
+        "files": files or [],
+        "groups": [{"number": number, "files": group_files} for number, group_files in groups or []],
+    }
+    with open(os.path.join(directory, SHARD_MANIFEST_NAME), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+
+def merge_shards(output_dir="out", allow_missing=False):
+    """Combine the shard-*-of-N directories in output_dir into one result in output_dir.
+
+    Groups are renumbered consecutively in shard order, signed PDFs and build manifests are
+    merged, and file_list.pdf is regenerated from every shard's inputs. Missing shards are an
+    error unless allow_missing is set, and so is any name two shards (or a file already in
+    output_dir) would both write. The shard directories are only removed once the merged
+    result is complete, so a failed merge can be fixed and run again.
+    """
+    shards = []
+    for name in os.listdir(output_dir):
+        match = re.fullmatch(r"shard-(\d+)-of-(\d+)", name)
+        if match and os.path.isdir(os.path.join(output_dir, name)):
+            shards.append((int(match.group(1)), int(match.group(2)), os.path.join(output_dir, name)))
+    if not shards:
+        print(f"No shard directories found in {output_dir}")
+        return
+    shards.sort()
+    counts = {count for _, count, _ in shards}
+    if len(counts) != 1:
+        raise ValueError(f"Shard directories from different partitionings: {sorted(counts)}")
+    missing = set(range(1, counts.pop() + 1)) - {index for index, _, _ in shards}
+    if missing:
+        if not allow_missing:
+            raise ValueError(f"Missing shards {sorted(missing)}; run them first or allow a partial merge")
+        print(f"Warning: missing shards {sorted(missing)}")
+
+    files = []
+    groups = []
+    entries = {}
+    moves = {}  # name in output_dir -> path inside a shard directory
+    for index, count, directory in shards:
+        manifest = load_shard_manifest(directory)
+        files.extend(manifest["files"])
+
+        # Give the shard's groups the next global numbers
+        numbers = {}
+        for group in manifest["groups"]:
+            numbers[group["number"]] = len(groups) + 1
+            groups.append({"number": len(groups) + 1, "shard": index, "files": group["files"]})
+
+        build_manifest = os.path.join(directory, MANIFEST_NAME)
+        if os.path.exists(build_manifest):
+            with open(build_manifest, "r", encoding="utf-8") as file:
+                entries.update(json.load(file).get("entries", {}))
+
+        # Group outputs are renumbered, everything else (signed PDFs) keeps its name
+        for name in os.listdir(directory):
+            if name in (SHARD_MANIFEST_NAME, MANIFEST_NAME):
+                continue
+            match = re.fullmatch(r"(.*)_group_(\d+)\.pdf", name)
+            if match and int(match.group(2)) in numbers:
+                new_name = f"{match.group(1)}_group_{numbers[int(match.group(2))]}.pdf"
+            else:
+                new_name = name
+            if new_name in moves:
+                raise ValueError(f"{new_name} is produced by more than one shard "
+                                 f"({moves[new_name]} and {os.path.join(directory, name)})")
+            moves[new_name] = os.path.join(directory, name)
+
+    generated = ["groups.json"] + ([MANIFEST_NAME] if entries else []) + (["file_list.pdf"] if files else [])
+    existing = sorted(name for name in list(moves) + generated if os.path.exists(os.path.join(output_dir, name)))
+    if existing:
+        raise ValueError(f"{output_dir} already contains {', '.join(existing)}; merge into a clean directory")
+
+    # Copy rather than move so the shards stay intact until everything has been written
+    written = []
+    try:
+        for new_name, path in moves.items():
+            written.append(os.path.join(output_dir, new_name))
+            if os.path.isdir(path):
+                shutil.copytree(path, written[-1])
+            else:
+                shutil.copy2(path, written[-1])
+
+        if entries:
+            written.append(os.path.join(output_dir, MANIFEST_NAME))
+            save_manifest(output_dir, entries)
+        if files:
+            from listofpdf import generate_file_list
+
+            output_pdf_path = os.path.join(output_dir, 'file_list.pdf')
+            written.append(output_pdf_path)
+            generate_file_list([os.path.splitext(f)[0] for f in files], output_pdf_path)
+            print(f"PDF file created: {output_pdf_path}")
+        written.append(os.path.join(output_dir, "groups.json"))
+        with open(written[-1], "w", encoding="utf-8") as file:
+            json.dump(groups, file, ensure_ascii=False, indent=1)
+    except BaseException:
+        # Leave output_dir as it was so the merge can simply be run again
+        for path in written:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+        raise
+
+    for index, count, directory in shards:
+        shutil.rmtree(directory)
+        print(f"Merged shard {index}/{count}")
+    print(f"Merged {len(shards)} shards into {output_dir} with {len(groups)} groups")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge per-shard outputs into one result.")
+    parser.add_argument("output_dir", nargs="?", default="out")
+    parser.add_argument("--allow-missing", action="store_true",
+                        help="merge even if some shards of the partitioning have not been produced")
+    args = parser.parse_args()
+    try:
+        merge_shards(args.output_dir, allow_missing=args.allow_missing)
+    except ValueError as e:
+        parser.exit(1, f"Cannot merge shards: {e}\n")
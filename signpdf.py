@@ -1,14 +1,31 @@
 import os
 import shutil
-from PyPDF2 import PdfWriter, PdfReader
+from PyPDF2 import PageObject, PdfWriter, PdfReader
+from PyPDF2.generic import (
+    ArrayObject,
+    ByteStringObject,
+    ContentStream,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    NameObject,
+    NumberObject,
+)
 import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-import pdfplumber  # Import pdfplumber for better text extraction
 import re
-from collections import defaultdict
+import json
+import argparse
+import importlib
+from contextlib import redirect_stdout
+from functools import lru_cache, wraps
+from multiprocessing import Pool
+from anchor_cache import AnchorCache
+from incremental_update import append_overlay, rename_overlay_fonts
+from manifest import build_key, file_hash, load_manifest, save_manifest
+from metrics import MetricsWriter, measure_file, note, profile_call, stage
+from pdf_source import PdfSource, open_source, parse_memory_budget
+from sharding import parse_shard, select_shard, shard_dir, write_shard_manifest
+from text_backends import BACKENDS
 
 # Default configuration for text positioning
 DEFAULT_TEXT_X_POSITION = 65  # X coordinate for text
@@ -19,6 +36,65 @@ LINE_HEIGHT = 15  # Standard line height for text positioning
 # Global variable to enable special Y position detection
 CALCULATE_POSITION = True  # Set to True to enable the new strategy
 
+# Set to True to stamp the overlay as a PDF incremental update instead of rewriting the file
+INCREMENTAL_UPDATE = False
+
+# Set to True to memory-map each input instead of reading it into memory; either way every
+# library parsing an input shares one buffer, so the file is only read from disk once
+USE_MMAP = False
+
+# Number of rendered overlay pages kept in memory, keyed by (text, x, y, font, size)
+OVERLAY_CACHE_SIZE = 256
+
+# Set to True to write the overlay's content stream directly instead of drawing it with
+# reportlab, against one DejaVu subset of DIRECT_OVERLAY_CHARACTERS built once per process
+# (each output then carries that whole subset); other texts still go through reportlab
+DIRECT_OVERLAY = False
+DIRECT_OVERLAY_CHARACTERS = ''.join(map(chr, range(32, 127))) + ''.join(map(chr, range(0x410, 0x450))) + 'Ёё'
+
+# Set to True to keep up-to-date outputs and only re-sign new or changed inputs
+INCREMENTAL_BUILD = False
+
+# Text extraction backend for anchor detection: "pdfplumber" (reference) or "pymupdf" (fast)
+TEXT_BACKEND = "pdfplumber"
+
+# Set to True to reuse anchor detection results across runs from an on-disk cache
+USE_ANCHOR_CACHE = False
+ANCHOR_CACHE_FILE = ".signpdf-anchor-cache.sqlite"
+ANCHOR_CACHE_MAX_ENTRIES = 100000  # Least recently used entries are evicted beyond this
+
+# Bands searched for anchors, as fractions of the page height from the top; each band is
+# only extracted when the previous ones did not settle the result (1 = the whole page).
+# None uses the text backend's SEARCH_BANDS
+ANCHOR_SEARCH_BANDS = None
+
+# Bump when the anchor rules in detect_anchor change so cached positions and incrementally
+# built outputs are recomputed
+ANCHOR_RULES_VERSION = 1
+
+# Number of worker processes used to sign files (1 = serial, 0 = one per CPU core)
+WORKERS = 1
+
+# Path of a JSON lines file to write per-file stage timings to (None = no metrics)
+METRICS_FILE = None
+
+# Memory budget per process in MB for very large inputs (None = unlimited). Inputs too large
+# to rewrite within it are memory-mapped and stamped as an incremental update, which parses
+# only the first page and copies the rest of the file through unchanged
+MEMORY_BUDGET_MB = None
+
+# Peak memory of rewriting a PDF with PyPDF2 relative to the size of the input
+REWRITE_MEMORY_FACTOR = 4
+
+def set_memory_budget(megabytes):
+    """Set MEMORY_BUDGET_MB; also the Pool initializer that passes it on to worker processes."""
+    global MEMORY_BUDGET_MB
+    MEMORY_BUDGET_MB = megabytes
+
+def exceeds_memory_budget(size):
+    """True if rewriting an input of size bytes would not fit in MEMORY_BUDGET_MB."""
+    return MEMORY_BUDGET_MB is not None and size * REWRITE_MEMORY_FACTOR > MEMORY_BUDGET_MB * 1024 * 1024
+
 # Function to load coordinates from coordinates.txt file
 def load_coordinates():
     coordinates = {
@@ -41,49 +117,357 @@ def load_coordinates():
 
     return coordinates["TEXT_X_POSITION"], coordinates["TEXT_Y_POSITION"]
 
-def find_quiz_review_y_position(input_file):
+def open_first_page(input_file, backend=None):
+    """Open the first page of input_file with the selected text extraction backend."""
+    return BACKENDS[backend or TEXT_BACKEND](input_file)
+
+def load_first_page_layout(input_file, backend=None):
+    """Parse the whole first page of input_file with the selected text extraction backend."""
+    with open_first_page(input_file, backend) as first_page:
+        return first_page.layout()
+
+def find_quiz_review_y_position(layout):
     """Find the Y position below all occurrences of 'quiz/review'."""
-    with pdfplumber.open(input_file) as pdf:  # Open the PDF file directly
-        first_page = pdf.pages[0]
-        
-        # Extract words with their bounding boxes
-        words = first_page.extract_words()
-        
-        # Sort words by their top position (Y coordinate) in ascending order
-        words.sort(key=lambda w: w['top'])
-        
-        # List to store positions of all occurrences
-        positions = []
-        
-        # Get the actual height of the page
+    # List to store positions of all occurrences
+    positions = []
+
+    # Scan through the sorted words to find "quiz/review"
+    for word in layout.words:
+        if 'quiz/review' in word['text'].lower():  # Case-insensitive search
+            # Get the Y position of the found word
+            y_position = layout.page_height - (word['top'] + 10)  # Adjust for padding
+            x_position = word['doctop']  # Get the X position from the word's bounding box
+
+            # Store the position if needed
+            positions.append((x_position, y_position))
+
+    return positions  # Return the list of positions if found
+
+def find_line_y_position(layout, pattern):
+    """Find the Y position just above the first line matching pattern, or None."""
+    for top, texts in layout.lines_by_top.items():
+        line = ' '.join(texts)
+        if pattern.search(line):
+            # Place imprint just above this line
+            return layout.page_height - (top - 22)
+    return None
+
+# Lines the imprint goes above when 'quiz/review' is too low on the page, tried in order
+FALLBACK_LINES = (
+    ("тест начат", re.compile(r'тест[\W_]*начат', re.IGNORECASE)),
+    ("вопрос 1", re.compile(r'вопрос[\W_]*1', re.IGNORECASE)),
+)
+
+def match_anchor(bands, page_height):
+    """Apply the anchor rules to the layouts yielded by bands(), a band at a time.
+
+    bands is called again for each rule, so it should only extract a band once. Returns
+    (y_position, rule, page_height) like detect_anchor.
+    """
+    # Bands always start at the top, so the first band with an occurrence holds the topmost one
+    for layout in bands():
+        positions = find_quiz_review_y_position(layout)
+        if positions:
+            break
+    else:
+        return None, "no quiz/review", page_height
+
+    # Use the Y position of the first occurrence if it is in the first third of the page
+    # Remember: y=0 is at the bottom, so first third is y > 2/3*page_height
+    y_position = positions[0][1]
+    if y_position > (2 * page_height / 3):
+        return y_position, "quiz/review", page_height
+
+    # Try to find 'Тест Начат' and place imprint above that line,
+    # then 'Вопрос 1' if 'тест начат' was not found anywhere
+    for rule, pattern in FALLBACK_LINES:
+        for layout in bands():
+            y_position = find_line_y_position(layout, pattern)
+            if y_position is not None:
+                return y_position, rule, page_height
+
+    return None, "no fallback line", page_height
+
+def detect_anchor(input_file, backend=None):
+    """Apply the anchor rules to the first page of input_file.
+
+    Returns (y_position, rule, page_height). rule names the anchor that matched; when
+    nothing suitable was found y_position is None and rule says why.
+    """
+    with stage("extract"):
+        first_page = open_first_page(input_file, backend)
+    with first_page:
         page_height = first_page.height
-        
-        # Scan through the sorted words to find "quiz/review"
-        for word in words:
-            if 'quiz/review' in word['text'].lower():  # Case-insensitive search
-                # Get the Y position of the found word
-                y_position = page_height - (word['top'] + 10)  # Adjust for padding
-                x_position = word['doctop']  # Get the X position from the word's bounding box
-                
-                # Removed the print statement for found positions
-                # print(f"Found 'quiz/review' at X: {x_position}, Y: {y_position}")
-                
-                # Store the position if needed
-                positions.append((x_position, y_position))
-        
-        return positions  # Return the list of positions if found
-        
-    return None  # Return None if 'quiz/review' is not found
+        layouts = {}
+
+        def bands():
+            # Yield the layout of each search band, growing from the top of the page
+            for fraction in ANCHOR_SEARCH_BANDS or first_page.SEARCH_BANDS:
+                bottom = None if fraction >= 1 else fraction * page_height
+                if bottom not in layouts:
+                    with stage("extract"):
+                        layouts[bottom] = first_page.layout(bottom)
+                yield layouts[bottom]
 
-# Register DejaVu Sans font for Cyrillic support using a relative path (adjust this based on your project directory)
+        with stage("rules"):
+            return match_anchor(bands, page_height)
+
+_anchor_cache = None
+
+def anchor_cache():
+    """The persistent anchor cache, opened on first use from ANCHOR_CACHE_FILE and
+    ANCHOR_CACHE_MAX_ENTRIES as they are then (and reopened if they change)."""
+    global _anchor_cache
+    if _anchor_cache is None or (_anchor_cache.path, _anchor_cache.max_entries) != (ANCHOR_CACHE_FILE, ANCHOR_CACHE_MAX_ENTRIES):
+        _anchor_cache = AnchorCache(ANCHOR_CACHE_FILE, ANCHOR_CACHE_MAX_ENTRIES)
+    return _anchor_cache
+
+def detect_anchor_cached(input_file):
+    """detect_anchor backed by the persistent anchor cache when USE_ANCHOR_CACHE is set."""
+    if not USE_ANCHOR_CACHE:
+        return detect_anchor(input_file)
+    with open_source(input_file, USE_MMAP) as source:
+        key = f"{source.sha256()}:{ANCHOR_RULES_VERSION}:{TEXT_BACKEND}"
+        cached = anchor_cache().get(key)
+        note(anchor_cache_hit=cached is not None)
+        if cached is not None:
+            return tuple(cached)
+        result = detect_anchor(source)
+    anchor_cache().put(key, list(result))
+    return result
+
+# DejaVu Sans font for Cyrillic support using a relative path (adjust this based on your project directory)
 font_path = os.path.join(os.path.dirname(__file__), 'fonts', 'DejaVuSans.ttf')
-pdfmetrics.registerFont(TTFont('DejaVu', font_path))
 
-# Create input directory if it doesn't exist
+# Input directory scanned by main()
 input_dir = "in"
-os.makedirs(input_dir, exist_ok=True)
+
+@lru_cache(maxsize=None)
+def register_font():
+    """Register the DejaVu font with reportlab; runs once per process."""
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    pdfmetrics.registerFont(TTFont('DejaVu', font_path))
+
+def warm_up(backend=None):
+    """Pay the import and font registration costs up front, e.g. when a service starts."""
+    register_font()
+    importlib.import_module("reportlab.pdfgen.canvas")
+    # Backends import their library on first use, so load it now
+    importlib.import_module(BACKENDS[backend or TEXT_BACKEND].LIBRARY)
+
+def overlay_cache(func):
+    """Like lru_cache(maxsize=OVERLAY_CACHE_SIZE), but sized when first called rather than at
+    import, so the setting can still be changed (and resized again later)."""
+    cached = None
+
+    @wraps(func)
+    def wrapper(*args):
+        nonlocal cached
+        if cached is None or cached.cache_parameters()["maxsize"] != OVERLAY_CACHE_SIZE:
+            cached = lru_cache(maxsize=OVERLAY_CACHE_SIZE)(func)
+        return cached(*args)
+
+    def cache_clear():
+        nonlocal cached
+        cached = None
+
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+@overlay_cache
+def render_overlay(text, x_pos, y_pos, font_name, font_size):
+    """Render text at (x_pos, y_pos) on a one-page PDF and return the parsed page.
+
+    Pages are cached and only ever read by merge_page, so they can be shared between files.
+    """
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+
+    register_font()
+
+    # Create text overlay
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=letter)
+    can.setFont(font_name, font_size)
+
+    # Set text color (black)
+    can.setFillColorRGB(0, 0, 0)  # RGB for black
+
+    can.drawString(x_pos, y_pos, text)
+    can.save()
+    packet.seek(0)
+
+    # Create new PDF with text
+    return PdfReader(packet).pages[0]
+
+def _pdf_number(value):
+    return NumberObject(value) if isinstance(value, int) else FloatObject(value)
+
+@lru_cache(maxsize=None)
+def direct_overlay_font():
+    """The DejaVu subset every direct overlay shares, as (font reference, character codes).
+
+    Built from reportlab's font metrics and subsetter the way a canvas would embed it, but
+    once per process and with code n standing for DIRECT_OVERLAY_CHARACTERS[n - 1].
+    """
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import FF_NONSYMBOLIC, FF_SYMBOLIC, makeToUnicodeCMap
+
+    register_font()
+    face = pdfmetrics.getFont('DejaVu').face
+    subset = [0] + [ord(c) for c in DIRECT_OVERLAY_CHARACTERS]  # code 0 is .notdef
+    base_font = "AAAAAA+" + (face.name + face.subfontNameX).decode("latin-1")
+    # The font's streams have to be indirect objects, so a writer owns them
+    holder = PdfWriter()
+
+    def stream(data, **entries):
+        obj = DecodedStreamObject()
+        obj.set_data(data)
+        obj = obj.flate_encode()
+        for key, value in entries.items():
+            obj[NameObject(f"/{key}")] = value
+        return holder._add_object(obj)
+
+    font_file = face.makeSubset(subset)
+    descriptor = DictionaryObject({
+        NameObject("/Type"): NameObject("/FontDescriptor"),
+        NameObject("/Ascent"): _pdf_number(face.ascent),
+        NameObject("/CapHeight"): _pdf_number(face.capHeight),
+        NameObject("/Descent"): _pdf_number(face.descent),
+        NameObject("/Flags"): NumberObject(face.flags & ~FF_NONSYMBOLIC | FF_SYMBOLIC),
+        NameObject("/FontBBox"): ArrayObject(_pdf_number(v) for v in face.bbox),
+        NameObject("/FontName"): NameObject(f"/{base_font}"),
+        NameObject("/ItalicAngle"): _pdf_number(face.italicAngle),
+        NameObject("/StemV"): _pdf_number(face.stemV),
+        NameObject("/FontFile2"): stream(font_file, Length1=NumberObject(len(font_file))),
+        NameObject("/MissingWidth"): _pdf_number(face.defaultWidth),
+    })
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/TrueType"),
+        NameObject("/BaseFont"): NameObject(f"/{base_font}"),
+        NameObject("/FirstChar"): NumberObject(0),
+        NameObject("/LastChar"): NumberObject(len(subset) - 1),
+        NameObject("/Widths"): ArrayObject(_pdf_number(face.getCharWidth(code)) for code in subset),
+        NameObject("/ToUnicode"): stream(makeToUnicodeCMap(base_font, subset).encode("latin-1")),
+        NameObject("/FontDescriptor"): holder._add_object(descriptor),
+    })
+    return holder._add_object(font), {c: n for n, c in enumerate(DIRECT_OVERLAY_CHARACTERS, 1)}
+
+@overlay_cache
+def place_overlay(text, x_pos, y_pos, font_name, font_size):
+    """Overlay page for text at (x_pos, y_pos) with its content stream written directly.
+
+    The text is shown in the shared font from direct_overlay_font, so no canvas is drawn,
+    serialized or parsed; text that font cannot show is left to render_overlay.
+    """
+    font, codes = direct_overlay_font()
+    if font_name != 'DejaVu' or any(c not in codes for c in text):
+        return render_overlay(text, x_pos, y_pos, font_name, font_size)
+
+    content = ContentStream(None, None)
+    content.operations = [
+        ([], b"BT"),
+        ([NameObject("/F1"), _pdf_number(font_size)], b"Tf"),
+        ([NumberObject(0), NumberObject(0), NumberObject(0)], b"rg"),
+        ([NumberObject(1), NumberObject(0), NumberObject(0), NumberObject(1),
+          _pdf_number(x_pos), _pdf_number(y_pos)], b"Tm"),
+        ([ByteStringObject(bytes(codes[c] for c in text))], b"Tj"),
+        ([], b"ET"),
+    ]
+    page = PageObject.create_blank_page(width=612, height=792)  # letter, like render_overlay
+    page[NameObject("/Contents")] = content
+    page[NameObject("/Resources")] = DictionaryObject({
+        NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+        NameObject("/ProcSet"): ArrayObject([NameObject("/PDF"), NameObject("/Text")]),
+    })
+    return page
+
+def rename_overlay(overlay_page, page):
+    """Copy of overlay_page whose font names cannot clash with page's fonts.
+
+    merge_page gives clashing resources random names, which would make the output differ
+    from run to run; the cached overlay_page itself is left untouched.
+    """
+    content = ContentStream(overlay_page.get_contents(), overlay_page.pdf)
+    page_resources = page.get("/Resources", DictionaryObject()).get_object()
+    names = rename_overlay_fonts(content, page_resources.get("/Font", DictionaryObject()).get_object())
+
+    overlay_resources = overlay_page["/Resources"].get_object()
+    overlay_fonts = overlay_resources["/Font"].get_object()
+    resources = DictionaryObject(overlay_resources)
+    resources[NameObject("/Font")] = DictionaryObject(
+        {new_name: overlay_fonts.raw_get(name) for name, new_name in names.items()})
+
+    renamed = PageObject(overlay_page.pdf)
+    renamed.update(overlay_page)
+    renamed[NameObject("/Contents")] = content
+    renamed[NameObject("/Resources")] = resources
+    return renamed
+
+def merge_overlay(page, overlay_page):
+    """Merge overlay_page onto page so that the result is the same on every run.
+
+    merge_page builds /ProcSet from a set, whose order changes with the string hash seed, so
+    it is put back in page order followed by whatever the overlay adds.
+    """
+    procset = []
+    for source in (page, overlay_page):
+        resources = source.get("/Resources", DictionaryObject()).get_object()
+        for name in resources.get("/ProcSet", ArrayObject()).get_object():
+            if name not in procset:
+                procset.append(name)
+    page.merge_page(rename_overlay(overlay_page, page))
+    page["/Resources"][NameObject("/ProcSet")] = ArrayObject(procset)
+
+def copy_pdf(input_file, output_file):
+    """Copy input_file (a path or PdfSource) unchanged to output_file, a path or a binary stream."""
+    with stage("write"):
+        if isinstance(input_file, PdfSource):
+            input_file.write_to(output_file)
+        elif hasattr(output_file, "write"):
+            with open(input_file, "rb") as file:
+                shutil.copyfileobj(file, output_file)
+        else:
+            shutil.copy(input_file, output_file)
+
+def stamp_with_pymupdf(input_file, output_file, text, x_pos, y_pos):
+    """Stamp text on page 0 by copying input_file and appending the change with PyMuPDF.
+
+    The fallback for inputs over the memory budget that append_overlay cannot update (for
+    example encrypted ones): the copy is streamed and MuPDF only loads the first page.
+    Raises ValueError if the copy cannot be saved incrementally.
+    """
+    import fitz  # PyMuPDF
+    import tempfile
+
+    input_path = input_file.path if isinstance(input_file, PdfSource) else input_file
+    if hasattr(output_file, "write"):
+        # MuPDF appends to a file on disk, so go through a temporary copy
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = os.path.join(temp_dir, "stamped.pdf")
+            stamp_with_pymupdf(input_path, temp_path, text, x_pos, y_pos)
+            with open(temp_path, "rb") as file:
+                shutil.copyfileobj(file, output_file)
+        return
+
+    with stage("write"):
+        shutil.copyfile(input_path, output_file)
+    with stage("merge"):
+        with fitz.open(output_file) as doc:
+            if doc.needs_pass or not doc.can_save_incrementally():
+                raise ValueError("PyMuPDF cannot update it in place")
+            page = doc[0]
+            # PDF coordinates start at the bottom of the page, PyMuPDF's at the top
+            page.insert_text((x_pos, page.mediabox.height - y_pos), text, fontsize=DEFAULT_TEXT_SIZE,
+                             fontname="DejaVu", fontfile=font_path)
+            doc.saveIncr()
 
 def process_pdf(input_file, output_file, text, x_pos, y_pos):
+    """Stamp text on the first page of input_file into output_file; returns False if the
+    file was copied unchanged instead."""
     # Only create text overlay if y_pos is not None
     if y_pos is not None:
         # Adjust the Y position to place the text one line lower only if dynamic mode is enabled
@@ -96,122 +480,282 @@ def process_pdf(input_file, output_file, text, x_pos, y_pos):
         # Print the Y position and text being added
         print(f"Creating text overlay at X: {x_pos}, Y: {y_pos}, Text: '{text}'")
         
-        # Create text overlay
-        packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=letter)
-        can.setFont('DejaVu', DEFAULT_TEXT_SIZE)
-        
-        # Set text color (black)
-        can.setFillColorRGB(0, 0, 0)  # RGB for black
-        
-        can.drawString(x_pos, y_pos, text)
-        can.save()
-        packet.seek(0)
-        
-        # Create new PDF with text
-        new_pdf = PdfReader(packet)
-        
-        with open(input_file, "rb") as file:
-            existing_pdf = PdfReader(file)
-            output = PdfWriter()
-            
-            # Merge pages
-            for page in existing_pdf.pages:
-                if page == existing_pdf.pages[0]:  # Add text only to first page
-                    page.merge_page(new_pdf.pages[0])
-                output.add_page(page)
+        # Reuse the overlay when the same text lands at the same spot
+        with stage("render"):
+            if DIRECT_OVERLAY:
+                overlay_page = place_overlay(text, x_pos, y_pos, 'DejaVu', DEFAULT_TEXT_SIZE)
+            else:
+                overlay_page = render_overlay(text, x_pos, y_pos, 'DejaVu', DEFAULT_TEXT_SIZE)
+
+        size = len(input_file) if isinstance(input_file, PdfSource) else os.path.getsize(input_file)
+        over_budget = exceeds_memory_budget(size)
+        if INCREMENTAL_UPDATE or over_budget:
+            try:
+                # Append the overlay to the untouched original bytes
+                with stage("merge"):
+                    append_overlay(input_file, output_file, overlay_page)
+                return True
+            except ValueError as e:
+                if not over_budget:
+                    print(f"Incremental update not possible: {e}. Rewriting file.")
+                else:
+                    # A PyPDF2 rewrite would not fit in the budget; let MuPDF append the stamp
+                    try:
+                        stamp_with_pymupdf(input_file, output_file, text, x_pos, y_pos)
+                        print(f"Incremental update not possible: {e}. Stamped with PyMuPDF.")
+                        return True
+                    except (ValueError, RuntimeError) as fallback_error:
+                        print(f"SKIP {text} - cannot stamp within the memory budget ({e}; {fallback_error}). "
+                              f"Saving original file.")
+                        if hasattr(output_file, "seek"):
+                            output_file.seek(0)
+                            output_file.truncate()
+                        copy_pdf(input_file, output_file)
+                        return False
+
+        with open_source(input_file, USE_MMAP or exceeds_memory_budget(size)) as source:
+            with stage("merge"):
+                existing_pdf = PdfReader(source.stream())
+                output = PdfWriter()
+                
+                # Merge pages
+                for page in existing_pdf.pages:
+                    if page == existing_pdf.pages[0]:  # Add text only to first page
+                        merge_overlay(page, overlay_page)
+                    output.add_page(page)
             
-            # Save output
-            with open(output_file, "wb") as output_stream:
-                output.write(output_stream)
+            # Save output (PdfWriter accepts a path or a binary stream)
+            with stage("write"):
+                output.write(output_file)
+        return True
     else:
         # If no valid y_pos, just copy the original PDF to output
-        shutil.copy(input_file, output_file)
-
-# Clear the output directory before starting
-output_dir = "out"
-if os.path.exists(output_dir):
-    # Remove all files in the output directory
-    for file_name in os.listdir(output_dir):
-        file_path = os.path.join(output_dir, file_name)
-        if os.path.isfile(file_path):
-            os.remove(file_path)
-
-# Create output directory if it doesn't exist
-os.makedirs(output_dir, exist_ok=True)
-
-# Load coordinates from coordinates.txt or use default
-TEXT_X_POSITION, TEXT_Y_POSITION = load_coordinates()
-
-# Process all PDFs in input directory
-for filename in os.listdir(input_dir):
-    if filename.endswith(".pdf"):
-        input_path = os.path.join(input_dir, filename)
-        output_path = os.path.join(output_dir, filename.replace(".pdf", "-sgn.pdf"))
-        
-        # Extract text from the filename - moved to function to ensure consistency
-        def extract_text_from_filename(filename):
-            text = os.path.splitext(filename)[0]
-            text = text.split('_', 1)[0]  # Split by the first underscore and keep the first part
-            return text
-                
+        copy_pdf(input_file, output_file)
+        return False
+
+# Extract text from the filename - kept as a function to ensure consistency
+def extract_text_from_filename(filename):
+    text = os.path.splitext(filename)[0]
+    text = text.split('_', 1)[0]  # Split by the first underscore and keep the first part
+    return text
+
+def detect_position(input_path):
+    """Return (y_position, rule, page_height) for the imprint on input_path's first page.
+
+    input_path may also be an open PdfSource. y_position is None when no anchor rule matched;
+    rule names the matching rule or why nothing matched.
+    """
+    return detect_anchor_cached(input_path)
+
+def sign_file(input_path, output_path, text=None, x_pos=DEFAULT_TEXT_X_POSITION, y_pos=DEFAULT_TEXT_Y_POSITION):
+    """Stamp text on the first page of input_path and write the result to output_path.
+
+    output_path may also be a binary stream such as io.BytesIO. text defaults to the name
+    taken from the input filename. When CALCULATE_POSITION is set, y_pos is replaced by the
+    detected position; if no position is found the original file is copied unchanged.
+    The input is read from disk once and shared by detection, stamping and copying.
+    Returns True if the file was stamped.
+    """
+    filename = os.path.basename(input_path)
+    if text is None:
         text = extract_text_from_filename(filename)
-        
+
+    # Inputs too large for the memory budget are mapped rather than read into memory
+    use_mmap = USE_MMAP or exceeds_memory_budget(os.path.getsize(input_path))
+    with open_source(input_path, use_mmap) as source:
+        note(bytes_in=len(source))
         # If the special global variable is set, find the Y position
         if CALCULATE_POSITION:
-            positions = find_quiz_review_y_position(input_path)  # Pass the input path directly
-            if positions:  # Only update if any positions were found
-                # Set TEXT_Y_POSITION to the Y position of the first occurrence
-                TEXT_Y_POSITION = positions[0][1]
-                # Get the page height using pdfplumber
-                with pdfplumber.open(input_path) as pdf:
-                    page_height = pdf.pages[0].height
-                # Check if TEXT_Y_POSITION is in the first third of the page (from the top)
-                # Remember: y=0 is at the bottom, so first third is y > 2/3*page_height
-                if TEXT_Y_POSITION <= (2 * page_height / 3):
-                    # Try to find 'Тест Начат' and place imprint above that line
-                    with pdfplumber.open(input_path) as pdf:
-                        first_page = pdf.pages[0]
-                        words = first_page.extract_words()
-                        found_test_line = False
-                        # Join all words with their delimiters to reconstruct the line
-                        line_texts = []
-                        for word in words:
-                            line_texts.append((word['text'], word['top']))
-                        # Group by 'top' to reconstruct lines
-                        lines_by_top = defaultdict(list)
-                        for word_text, top in line_texts:
-                            lines_by_top[top].append(word_text)
-                        # Now check each line for the pattern
-                        pattern = re.compile(r'тест[\W_]*начат', re.IGNORECASE)
-                        for top, texts in lines_by_top.items():
-                            line = ' '.join(texts)
-                            if pattern.search(line):
-                                # Place imprint just above this line (10 units above its top)
-                                TEXT_Y_POSITION = page_height - (top - 22)
-                                found_test_line = True
-                                break
-                        
-                        # Try to find 'Вопрос 1' if 'тест начат' was not found
-                        if not found_test_line:
-                            question_pattern = re.compile(r'вопрос[\W_]*1', re.IGNORECASE)
-                            for top, texts in lines_by_top.items():
-                                line = ' '.join(texts)
-                                if question_pattern.search(line):
-                                    # Place imprint just above this line (similar to test начат placement)
-                                    TEXT_Y_POSITION = page_height - (top - 22)
-                                    found_test_line = True
-                                    break
-                            
-                        if not found_test_line:
-                            print(f"SKIP {filename} - no suitable position (neither 'тест начат' nor 'Вопрос 1' found)")
-                            shutil.copy(input_path, output_path)
-                            continue  # Skip to the next file
-            else:
-                # If no positions were found, save the original file in the output directory
-                print(f"No occurrences of 'quiz/review' found in {filename}. Saving original file.")
-                shutil.copy(input_path, output_path)  # Copy the original PDF to output
-                continue  # Skip to the next file
-        
+            y_position, rule, _ = detect_position(source)
+            note(rule=rule)
+            if y_position is None:
+                if rule == "no quiz/review":
+                    print(f"No occurrences of 'quiz/review' found in {filename}. Saving original file.")
+                else:
+                    print(f"SKIP {filename} - no suitable position (neither 'тест начат' nor 'Вопрос 1' found)")
+                # Save the original file in the output directory
+                copy_pdf(source, output_path)
+                return False
+            y_pos = y_position
+
         # Only call process_pdf if we have a valid Y position
-        process_pdf(input_path, output_path, text, TEXT_X_POSITION, TEXT_Y_POSITION)
+        return process_pdf(source, output_path, text, x_pos, y_pos)
+
+def sign_one(filename, input_dir, output_dir, x_pos, y_pos):
+    """Sign one file of a batch directory and return its metrics record.
+
+    The job only depends on its arguments, so it can run in any worker process.
+    """
+    input_path = os.path.join(input_dir, filename)
+    output_path = os.path.join(output_dir, output_name_for(filename))
+    with measure_file(filename) as record:
+        record["stamped"] = sign_file(input_path, output_path, None, x_pos, y_pos)
+        record["bytes_out"] = os.path.getsize(output_path)
+    return record
+
+def _sign_one_captured(args):
+    """Run sign_one in a worker and return its log output instead of printing it."""
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        sign_one(*args)
+    return buffer.getvalue()
+
+def _sign_one_measured(args):
+    """Run sign_one in a worker and return its log output and metrics record."""
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        record = sign_one(*args)
+    return buffer.getvalue(), record
+
+def output_name_for(filename):
+    return filename.replace(".pdf", "-sgn.pdf")
+
+def clear_output_dir(output_dir):
+    if os.path.exists(output_dir):
+        # Remove all files in the output directory
+        for file_name in os.listdir(output_dir):
+            file_path = os.path.join(output_dir, file_name)
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+
+def build_settings(x_pos, y_pos):
+    """Everything besides the input itself that changes what an output looks like."""
+    return {
+        "x": x_pos,
+        "y": y_pos,
+        "calculate_position": CALCULATE_POSITION,
+        "text_backend": TEXT_BACKEND,
+        # Bumped whenever the anchor rules change where a stamp goes
+        "anchor_rules_version": ANCHOR_RULES_VERSION,
+        "line_height": LINE_HEIGHT,
+        "text_size": DEFAULT_TEXT_SIZE,
+        "incremental_update": INCREMENTAL_UPDATE,
+        # Both change how the stamp is written: a budget sends large inputs down the
+        # incremental paths, a direct overlay embeds the shared subset of its characters
+        "memory_budget_mb": MEMORY_BUDGET_MB,
+        "direct_overlay": DIRECT_OVERLAY_CHARACTERS if DIRECT_OVERLAY else False,
+        "font": file_hash(font_path),
+    }
+
+def select_changed(jobs, output_dir, settings):
+    """Drop jobs whose outputs are up to date and prune outputs whose inputs are gone.
+
+    Returns the remaining jobs and the manifest entries to save once they are done.
+    """
+    previous = load_manifest(output_dir)
+    entries = {}
+    changed = []
+    for job in jobs:
+        filename, input_dir = job[0], job[1]
+        output_name = output_name_for(filename)
+        key = build_key(input=file_hash(os.path.join(input_dir, filename)),
+                        text=extract_text_from_filename(filename), settings=settings)
+        entries[output_name] = {"input": filename, "key": key}
+        entry = previous.get(output_name)
+        if entry and entry["key"] == key and os.path.exists(os.path.join(output_dir, output_name)):
+            continue
+        changed.append(job)
+
+    for output_name in previous.keys() - entries.keys():
+        output_path = os.path.join(output_dir, output_name)
+        if os.path.isfile(output_path):
+            os.remove(output_path)
+            print(f"Removed stale output {output_path}")
+
+    print(f"{len(jobs) - len(changed)} outputs up to date, {len(changed)} to sign")
+    return changed, entries
+
+def main(workers=None, shard=None, metrics_file=None):
+    """Sign every PDF in in/ into out/, or with shard=(i, N) only the i-th of N slices into
+    its own directory under out/ (combine the shards afterwards with sharding.py).
+
+    With metrics_file, per-file stage timings are written there as JSON lines.
+    """
+    if workers is None:
+        workers = WORKERS
+    if metrics_file is None:
+        metrics_file = METRICS_FILE
+
+    # Create input directory if it doesn't exist
+    os.makedirs(input_dir, exist_ok=True)
+
+    output_dir = "out" if shard is None else shard_dir("out", shard)
+    if not INCREMENTAL_BUILD:
+        # Clear the output directory before starting
+        clear_output_dir(output_dir)
+
+    # Create output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Load coordinates from coordinates.txt or use default
+    text_x_position, text_y_position = load_coordinates()
+
+    # Process all PDFs in input directory
+    filenames = [filename for filename in os.listdir(input_dir) if filename.endswith(".pdf")]
+    if shard is not None:
+        filenames = select_shard(filenames, shard)
+        write_shard_manifest(output_dir, shard, filenames)
+    jobs = [(filename, input_dir, output_dir, text_x_position, text_y_position) for filename in filenames]
+
+    if INCREMENTAL_BUILD:
+        jobs, entries = select_changed(jobs, output_dir, build_settings(text_x_position, text_y_position))
+
+    writer = MetricsWriter(metrics_file) if metrics_file else None
+    if workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            record = sign_one(*job)
+            if writer:
+                writer.write(record)
+    else:
+        # Jobs are independent; imap hands the log output back in input order
+        with Pool(processes=workers or None, initializer=set_memory_budget, initargs=(MEMORY_BUDGET_MB,)) as pool:
+            for log, record in pool.imap(_sign_one_measured, jobs, chunksize=4):
+                print(log, end='')
+                if writer:
+                    writer.write(record)
+
+    if INCREMENTAL_BUILD:
+        save_manifest(output_dir, entries)
+    if writer:
+        writer.close()
+
+def profile_one(filename, output_dir="out"):
+    """Sign in/filename into output_dir under cProfile and tracemalloc and print its metrics.
+
+    The raw profile is saved next to the output as <name>.prof.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    x_pos, y_pos = load_coordinates()
+    profile_path = os.path.join(output_dir, os.path.splitext(filename)[0] + ".prof")
+    record = profile_call(sign_one, filename, input_dir, output_dir, x_pos, y_pos, profile_path=profile_path)
+    print(json.dumps(record, ensure_ascii=False, indent=1))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stamp every PDF in in/ with the name from its filename into out/.")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="number of worker processes (1 = serial, 0 = one per CPU core)")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and sign PDFs as they arrive in in/")
+    parser.add_argument("--shard", type=parse_shard, metavar="I/N",
+                        help="sign only the I-th of N deterministic slices of in/ into out/shard-I-of-N/")
+    parser.add_argument("--metrics", metavar="PATH", default=METRICS_FILE,
+                        help="write per-file stage timings as JSON lines to PATH, with a summary at the end")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="sign only in/FILE under cProfile and tracemalloc and report where time and memory go")
+    parser.add_argument("--memory-budget", type=parse_memory_budget, metavar="MB", default=MEMORY_BUDGET_MB,
+                        help="keep each process within about MB megabytes for very large inputs")
+    args = parser.parse_args(argv)
+    if args.watch and args.shard:
+        parser.error("--watch and --shard cannot be combined")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    set_memory_budget(args.memory_budget)
+    if args.watch:
+        from watch_folder import watch
+        watch(input_dir, "out", workers=args.workers, memory_budget_mb=args.memory_budget)
+    elif args.profile:
+        profile_one(args.profile)
+    else:
+        main(workers=args.workers, shard=args.shard, metrics_file=args.metrics)
@@ -0,0 +1,143 @@
+from collections import defaultdict
+from pdf_source import PdfSource
+
+class FirstPageLayout:
+    """Words, lines and height of a PDF's first page (or a top band of it).
+
+    words are dicts with at least 'text', 'top' and 'doctop' (pdfplumber's convention:
+    distances from the top of the page), listed in reading order.
+    """
+
+    def __init__(self, words, page_height):
+        self.page_height = page_height
+
+        # Group words by 'top' to reconstruct lines (in extraction order)
+        self.lines_by_top = defaultdict(list)
+        for word in words:
+            self.lines_by_top[word['top']].append(word['text'])
+
+        # Sort words by their top position (Y coordinate) in ascending order
+        self.words = sorted(words, key=lambda w: w['top'])
+
+class PdfplumberFirstPage:
+    """Reference backend: pdfplumber/pdfminer layout analysis of the first page."""
+
+    LIBRARY = "pdfplumber"
+
+    # pdfminer lays out the whole page whatever the band, so searching bands saves nothing
+    SEARCH_BANDS = (1,)
+
+    def __init__(self, input_file):
+        import pdfplumber  # Import pdfplumber for better text extraction
+
+        if isinstance(input_file, PdfSource):
+            input_file = input_file.stream()
+        self._pdf = pdfplumber.open(input_file)  # Open the PDF file directly
+        self._page = self._pdf.pages[0]
+        self.height = self._page.height
+        self._words = None
+
+    def layout(self, bottom=None):
+        """Words whose top lies above `bottom` points from the top of the page (all if None)."""
+        if self._words is None:
+            # pdfminer parses the whole page whatever the crop, and cropping then clips every
+            # object, so words are extracted once and each band is a filter over them
+            self._words = self._page.extract_words()
+        words = self._words
+        if bottom is not None and bottom < self.height:
+            top = self._page.bbox[1]
+            words = [w for w in words if w['top'] - top < bottom]
+        return FirstPageLayout(words, self.height)
+
+    def close(self):
+        self._pdf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class PymupdfFirstPage:
+    """Fast backend: PyMuPDF word extraction of the first page.
+
+    Words are reported in pdfplumber's coordinates (MediaBox space, turned as /Rotate says),
+    so both backends agree on pages with a CropBox or a rotation.
+    """
+
+    LIBRARY = "fitz"
+
+    # Only the clipped band is extracted, and the quiz/review header usually lies in the top third
+    SEARCH_BANDS = (1 / 3, 1)
+
+    def __init__(self, input_file):
+        import fitz  # PyMuPDF
+
+        self._fitz = fitz
+        if isinstance(input_file, PdfSource):
+            self._doc = input_file.open_fitz()
+        else:
+            self._doc = fitz.open(input_file)
+        self._page = self._doc[0]
+
+        # PyMuPDF measures words from the top left of the CropBox, unrotated; go through PDF
+        # space and pdfminer's page matrix to the top left of the rotated MediaBox
+        page = self._page
+        x0, y0, x1, y1 = page.mediabox  # PDF coordinates
+        crop = page.cropbox  # PDF x, but y measured down from the top of the MediaBox
+        to_pdf = fitz.Matrix(1, 0, 0, -1, crop.x0, y1 - crop.y0)
+        rotation = page.rotation
+        if rotation == 90:
+            to_device = fitz.Matrix(0, -1, 1, 0, -y0, x1)
+        elif rotation == 180:
+            to_device = fitz.Matrix(-1, 0, 0, -1, x1, y1)
+        elif rotation == 270:
+            to_device = fitz.Matrix(0, 1, -1, 0, y1, -x0)
+        else:
+            to_device = fitz.Matrix(1, 0, 0, 1, -x0, -y0)
+        if rotation in (90, 270):
+            self.height = x1 - x0
+            self._top, left = self.height - x1, y0
+        else:
+            self.height = y1 - y0
+            self._top, left = self.height - y1, x0
+        from_device = fitz.Matrix(1, 0, 0, -1, left, self.height + self._top)
+        self._matrix = to_pdf * to_device * from_device
+        # pdfplumber reads words left to right and top to bottom as displayed, which spells
+        # upright text backwards once the page is turned by 180 or 270 degrees
+        self._reverse = rotation in (180, 270)
+
+    def layout(self, bottom=None):
+        """Words whose top lies above `bottom` points from the top of the page (all if None)."""
+        clip = None
+        if bottom is not None and bottom < self.height:
+            # Only the clipped band is extracted; it keeps every word that overlaps it
+            band = self._fitz.Rect(-1e6, self._top, 1e6, self._top + bottom)
+            clip = band * ~self._matrix
+        words = []
+        # (x0, top, x1, bottom, text, block, line, word)
+        for word in self._page.get_text("words", clip=clip):
+            rect = self._fitz.Rect(word[:4]) * self._matrix
+            if clip is None or rect.y0 - self._top < bottom:
+                text = word[4][::-1] if self._reverse else word[4]
+                words.append({'text': text, 'x0': rect.x0, 'x1': rect.x1, 'top': rect.y0,
+                              'bottom': rect.y1, 'doctop': rect.y0})
+
+        # pdfplumber lists words line by line from the top and left to right within a line
+        words.sort(key=lambda w: (w['top'], w['x0']))
+        return FirstPageLayout(words, self.height)
+
+    def close(self):
+        self._doc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Text extraction backends selectable for anchor detection
+BACKENDS = {
+    "pdfplumber": PdfplumberFirstPage,
+    "pymupdf": PymupdfFirstPage,
+}
@@ -0,0 +1,129 @@
+import os
+import signal
+import time
+from multiprocessing import Pool
+import signpdf
+
+# Seconds a file's size and modification time must stay unchanged before it is signed
+DEBOUNCE_SECONDS = 2.0
+
+# Seconds between directory scans when inotify is not available
+POLL_INTERVAL = 1.0
+
+class _PollWatcher:
+    """Fallback watcher: every input file is a candidate on every scan."""
+
+    def __init__(self, input_dir):
+        self.input_dir = input_dir
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, POLL_INTERVAL))
+        return os.listdir(self.input_dir)
+
+    def close(self):
+        pass
+
+class _InotifyWatcher:
+    """Linux watcher: only files that were written or moved into the directory are candidates."""
+
+    def __init__(self, input_dir):
+        import inotify_simple
+
+        self._inotify = inotify_simple.INotify()
+        flags = inotify_simple.flags
+        self._inotify.add_watch(input_dir, flags.CLOSE_WRITE | flags.MOVED_TO | flags.MODIFY)
+
+    def wait(self, timeout):
+        return [event.name for event in self._inotify.read(timeout=int(timeout * 1000))]
+
+    def close(self):
+        self._inotify.close()
+
+def _open_watcher(input_dir):
+    try:
+        watcher = _InotifyWatcher(input_dir)
+        print(f"Watching {input_dir} with inotify")
+    except (ImportError, OSError):
+        watcher = _PollWatcher(input_dir)
+        print(f"Watching {input_dir} by polling every {POLL_INTERVAL}s")
+    return watcher
+
+def _init_worker(memory_budget_mb=None):
+    # Ctrl+C is handled by the watching process, which shuts the pool down cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signpdf.set_memory_budget(memory_budget_mb)
+    signpdf.warm_up()
+
+def watch(input_dir="in", output_dir="out", workers=1, memory_budget_mb=None):
+    """Sign PDFs as they land in input_dir until interrupted.
+
+    A file is signed once its size and modification time have been stable for
+    DEBOUNCE_SECONDS, and again whenever it is replaced. Fonts, the overlay cache and the
+    worker processes stay warm between files. memory_budget_mb, if given, replaces
+    signpdf.MEMORY_BUDGET_MB in this process and the workers.
+    """
+    # Set it on the signpdf this module uses, which is not __main__ when run as signpdf.py --watch
+    if memory_budget_mb is not None:
+        signpdf.set_memory_budget(memory_budget_mb)
+    os.makedirs(input_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    text_x_position, text_y_position = signpdf.load_coordinates()
+
+    pool = None
+    if workers == 1:
+        signpdf.warm_up()
+    else:
+        pool = Pool(processes=workers or None, initializer=_init_worker, initargs=(signpdf.MEMORY_BUDGET_MB,))
+
+    watcher = _open_watcher(input_dir)
+    pending = {}  # filename -> (size, mtime, time the file was last seen changing)
+    signed = {}  # filename -> (size, mtime) of the version that was signed
+
+    # Files already waiting in the directory count as arrivals
+    candidates = os.listdir(input_dir)
+    try:
+        while True:
+            now = time.monotonic()
+            for filename in candidates:
+                if not filename.endswith(".pdf"):
+                    continue
+                pending.setdefault(filename, (None, None, now))
+
+            for filename, (size, mtime, changed_at) in list(pending.items()):
+                try:
+                    stat = os.stat(os.path.join(input_dir, filename))
+                except FileNotFoundError:
+                    del pending[filename]
+                    continue
+                if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                    # Still being written, restart the debounce timer
+                    pending[filename] = (stat.st_size, stat.st_mtime_ns, now)
+                    continue
+                if now - changed_at < DEBOUNCE_SECONDS:
+                    continue
+                del pending[filename]
+                if signed.get(filename) == (size, mtime):
+                    continue
+                signed[filename] = (size, mtime)
+
+                job = (filename, input_dir, output_dir, text_x_position, text_y_position)
+                if pool is None:
+                    try:
+                        signpdf.sign_one(*job)
+                    except Exception as e:
+                        # One broken upload must not stop the daemon
+                        print(f"ERROR {filename}: {e}", flush=True)
+                else:
+                    pool.apply_async(signpdf._sign_one_captured, (job,),
+                                     callback=lambda log: print(log, end='', flush=True),
+                                     error_callback=lambda e, name=filename: print(f"ERROR {name}: {e}", flush=True))
+
+            # Wake up often enough to notice when pending files settle
+            candidates = watcher.wait(DEBOUNCE_SECONDS / 2 if pending else 60)
+    except KeyboardInterrupt:
+        print("Stopping watch")
+    finally:
+        watcher.close()
+        if pool is not None:
+            pool.close()
+            pool.join()